@@ -23,6 +23,14 @@ class AbstractBaseSolution:
     @abstractmethod
     def __deepcopy__(self):
         return
+
+    def fingerprint(self):
+        # Bytes identifying the design for a shared evaluation store, or None to always evaluate it
+        return None
+
+    def evaluation_state(self):
+        # Attributes evaluate() sets besides the results it returns, which a shared evaluation store restores
+        return {'stable_system': self.stable_system}
     # ########### Basic operations for solutions
 
 
@@ -1,5 +1,6 @@
 import numpy
 import copy
+import heuristic_bursts.evaluation_store
 import heuristic_bursts.solution
 import random
 
@@ -8,11 +9,15 @@ class Agent(object):
     def __init__(self, options):
         # Setup agent according to options
         self.options = options
+        self.evaluation_store = None
+        if options.evaluation_store is not None:
+            self.evaluation_store = heuristic_bursts.evaluation_store.EvaluationStore(options.evaluation_store,
+                                                                                      options.evaluation_store_size)
 
         # Instantiate solution class and evaluate initial solution
         self.current_solution = heuristic_bursts.solution.Solution()
         current_solution_for_evaluation = copy.deepcopy(self.current_solution)
-        self.current_results = current_solution_for_evaluation.evaluate()
+        self.current_results = self.evaluate_solution(current_solution_for_evaluation)
         self.all_solution_qualities = []
 
         # Instantiate lists for team solutions
@@ -65,8 +70,8 @@ class Agent(object):
 
         # Initialize Markov matrices
         self.markov_k = 0.05
-        self.num_lowtier_rules = 7
-        self.num_hightier_rules = 5
+        self.num_lowtier_rules = heuristic_bursts.solution.Solution.num_lowtier_rules
+        self.num_hightier_rules = heuristic_bursts.solution.Solution.num_hightier_rules
         self.markov_matrix = numpy.ones((self.num_lowtier_rules + self.num_hightier_rules, self.num_lowtier_rules + self.num_hightier_rules))
         self.markov_normal = numpy.ones((self.num_lowtier_rules + self.num_hightier_rules, self.num_lowtier_rules + self.num_hightier_rules))
         self.normalize_markov()
@@ -113,7 +118,7 @@ class Agent(object):
         self.error = 'none'
         if self.candidate_solution.is_valid():
             # self.candidate_solution_for_evaluation.display_visual = True
-            self.candidate_results = self.candidate_solution_for_evaluation.evaluate()
+            self.candidate_results = self.evaluate_solution(self.candidate_solution_for_evaluation)
             if self.candidate_solution_for_evaluation.stable_system:
                 # Decide whether to keep the current solution or revert.
                 # Compare quality of candidate solution to current solution
@@ -141,6 +146,12 @@ class Agent(object):
 
         # Tune approach based on evaluation and decision.
 
+    def evaluate_solution(self, solution):
+        # Designs that any agent sharing the evaluation store has evaluated are not evaluated again
+        if self.evaluation_store is None:
+            return solution.evaluate()
+        return self.evaluation_store.evaluate(solution)
+
     def evaluate(self):
         # Calculate solution quality of current solution and candidate solution
         # self.current_solution_quality = sum([self.current_results[i] * self.weights[i] *
@@ -279,22 +290,14 @@ class Agent(object):
         all_rules = numpy.arange(self.num_lowtier_rules + self.num_hightier_rules)
 
         # Determine markov index of last rule applied
-        if self.last_tier == 'low':
-            last_rule_index = self.last_rule - 1
-        elif self.last_tier == 'high':
-            last_rule_index = self.last_rule + self.num_lowtier_rules - 2
+        last_rule_index = self.rule_index(self.last_tier, self.last_rule)
 
         # Extract probabilities for next rule based on last
         rule_probabilities = self.markov_normal[last_rule_index]
 
         # Probabilistically select next rule to be applied
         next_rule = numpy.random.choice(all_rules, p=rule_probabilities)
-        if next_rule < self.num_lowtier_rules:
-            self.rule = next_rule + 1
-            self.preferred_rule_tier = "low"
-        elif next_rule >= self.num_lowtier_rules:
-            self.rule = next_rule - self.num_lowtier_rules + 2
-            self.preferred_rule_tier = "high"
+        self.preferred_rule_tier, self.rule = self.rule_from_index(next_rule)
 
         if self.preferred_rule_tier == 'low':
             self.apply_lowtier_rule = True
@@ -307,12 +310,7 @@ class Agent(object):
 
         # Probabilistically select next rule to be applied
         next_rule = numpy.random.choice(all_rules, p=self.rule_probabilities_normal)
-        if next_rule < self.num_lowtier_rules:
-            self.rule = next_rule + 1
-            self.preferred_rule_tier = "low"
-        elif next_rule >= self.num_lowtier_rules:
-            self.rule = next_rule - self.num_lowtier_rules + 2
-            self.preferred_rule_tier = "high"
+        self.preferred_rule_tier, self.rule = self.rule_from_index(next_rule)
 
         if self.preferred_rule_tier == 'low':
             self.apply_lowtier_rule = True
@@ -321,16 +319,10 @@ class Agent(object):
 
     def update_markov(self, d_quality):
         # Determine markov index of last rule applied
-        if self.last_tier == 'low':
-            last_rule_index = self.last_rule - 1
-        elif self.last_tier == 'high':
-            last_rule_index = self.last_rule + self.num_lowtier_rules - 2
+        last_rule_index = self.rule_index(self.last_tier, self.last_rule)
 
         # Determine markov index of rule just applied
-        if self.preferred_rule_tier == 'low':
-            rule_index = self.rule - 1
-        elif self.preferred_rule_tier == 'high':
-            rule_index = self.rule + self.num_lowtier_rules - 2
+        rule_index = self.rule_index(self.preferred_rule_tier, self.rule)
 
         # Update markov matrix based on performance of rule on solution quality
         if d_quality > 0:
@@ -344,10 +336,7 @@ class Agent(object):
 
     def update_rule_probabilities(self, d_quality):
         # Determine markov index of rule just applied
-        if self.preferred_rule_tier == 'low':
-            rule_index = self.rule - 1
-        elif self.preferred_rule_tier == 'high':
-            rule_index = self.rule + self.num_lowtier_rules - 2
+        rule_index = self.rule_index(self.preferred_rule_tier, self.rule)
 
         # Update markov matrix based on performance of rule on solution quality
         if d_quality > 0:
@@ -359,6 +348,18 @@ class Agent(object):
 
         self.normalize_rule_probabilities()
 
+    def rule_index(self, tier, rule):
+        # Position of a rule in the Markov and probability matrices, low-tier rules first. Rules count from 1.
+        if tier == 'low':
+            return rule - 1
+        return self.num_lowtier_rules + rule - 1
+
+    def rule_from_index(self, index):
+        # Tier and rule number at a position in the Markov and probability matrices
+        if index < self.num_lowtier_rules:
+            return 'low', index + 1
+        return 'high', index - self.num_lowtier_rules + 1
+
     def normalize_markov(self):
         for i in range(0, len(self.markov_matrix)):
             self.markov_normal[i] = self.markov_matrix[i] / sum(self.markov_matrix[i])
@@ -0,0 +1,84 @@
+import os
+import pickle
+import sqlite3
+import time
+
+
+class EvaluationStore(object):
+    """Results of evaluated solutions kept in an SQLite file, so that agents in other teams or processes that reach
+    a design someone has already evaluated can read the results instead. Solutions are keyed by their fingerprint,
+    and the least recently used results are dropped once the store holds more than capacity of them."""
+
+    # Number of results written by one process between trims of the store back down to capacity
+    trim_period = 100
+
+    def __init__(self, path, capacity=100000):
+        self.path = path
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._connection = None
+        self._pid = None
+        self._writes = 0
+
+    def __getstate__(self):
+        # Connections cannot be pickled, so worker processes open their own
+        state = self.__dict__.copy()
+        state['_connection'] = None
+        state['_pid'] = None
+        return state
+
+    def evaluate(self, solution):
+        # Solutions without a fingerprint are always evaluated
+        key = solution.fingerprint()
+        if key is None:
+            return solution.evaluate()
+        key = solution.__class__.__name__.encode() + b':' + key
+
+        # Along with the results, a hit restores what evaluating the solution would have set on it
+        stored = self.get(key)
+        if stored is not None:
+            results, state = stored
+            for name, value in state.items():
+                setattr(solution, name, value)
+            return results
+
+        results = solution.evaluate()
+        self.put(key, (results, solution.evaluation_state()))
+        return results
+
+    def get(self, key):
+        connection = self._connect()
+        row = connection.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        connection.execute('UPDATE results SET used = ? WHERE key = ?', (time.time(), key))
+        self.hits += 1
+        return pickle.loads(row[0])
+
+    def put(self, key, value):
+        connection = self._connect()
+        connection.execute('INSERT OR REPLACE INTO results (key, value, used) VALUES (?, ?, ?)',
+                           (key, sqlite3.Binary(pickle.dumps(value, pickle.HIGHEST_PROTOCOL)), time.time()))
+        self._writes += 1
+        if self._writes % self.trim_period == 0:
+            self.trim()
+
+    def trim(self):
+        self._connect().execute('DELETE FROM results WHERE key IN '
+                                '(SELECT key FROM results ORDER BY used DESC LIMIT -1 OFFSET ?)', (self.capacity,))
+
+    def __len__(self):
+        return self._connect().execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+    def _connect(self):
+        # Each process opens its own connection. The store is a cache, so writes are not synced to disk.
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous=OFF')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS results (key BLOB PRIMARY KEY, value BLOB, used REAL)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS results_used ON results (used)')
+            self._pid = os.getpid()
+        return self._connection
@@ -8,6 +8,10 @@ class Options(object):
     interaction_period = 10
     interaction_style = 'scheduled'
 
+    # File of results shared by every agent that uses it, also across processes, and the number of results it keeps
+    evaluation_store = None
+    evaluation_store_size = 100000
+
     def __init__(self, **kwargs):
         self.__dict__.update(kwargs)
 
@@ -0,0 +1,31 @@
+import heuristic_bursts.agent
+import heuristic_bursts.options
+import heuristic_bursts.solution
+
+import numpy
+
+
+def test_every_rule_can_be_selected():
+    agent = heuristic_bursts.agent.Agent(heuristic_bursts.options.Options())
+    solution = heuristic_bursts.solution.Solution
+    rules = [('low', rule) for rule in range(1, solution.num_lowtier_rules + 1)] + \
+            [('high', rule) for rule in range(1, solution.num_hightier_rules + 1)]
+    assert(len(agent.rule_probabilities) == len(rules))
+
+    for index, (tier, rule) in enumerate(rules):
+        assert(agent.rule_index(tier, rule) == index and agent.rule_from_index(index) == (tier, rule))
+
+        # Selection that puts all the weight on the rule, without and with the Markov chain
+        agent.rule_probabilities = numpy.zeros(len(rules))
+        agent.rule_probabilities[index] = 1
+        agent.normalize_rule_probabilities()
+        agent.probabilistic_rule_select()
+        assert((agent.preferred_rule_tier, agent.rule) == (tier, rule))
+
+        agent.last_tier, agent.last_rule = 'high', 1
+        last = agent.rule_index('high', 1)
+        agent.markov_matrix[last] = numpy.zeros(len(rules))
+        agent.markov_matrix[last][index] = 1
+        agent.normalize_markov()
+        agent.markov_rule_select()
+        assert((agent.preferred_rule_tier, agent.rule) == (tier, rule))
@@ -0,0 +1,49 @@
+import heuristic_bursts.evaluation_store
+import truss.truss
+
+import copy
+import numpy as np
+import os
+import pickle
+import tempfile
+
+
+def test_store_shares_results_between_agents():
+    with tempfile.TemporaryDirectory() as directory:
+        first = heuristic_bursts.evaluation_store.EvaluationStore(os.path.join(directory, 'evaluations.sqlite'))
+        design = truss.truss.Truss()
+        results = first.evaluate(copy.deepcopy(design))
+        assert((first.hits, first.misses) == (0, 1))
+
+        # Another agent, here through a store handed over as it would be to a worker process
+        second = pickle.loads(pickle.dumps(first))
+        candidate = truss.truss.Truss()
+        candidate.stable_system = None
+        stored = second.evaluate(candidate)
+        assert(stored[0] == results[0] and (stored[1] == results[1]).all() and candidate.stable_system)
+        assert(candidate.mass == results[0] and (candidate.fos == results[1]).all() and second.hits == 1)
+
+        candidate.change_member_size(0, 5)
+        second.evaluate(candidate)
+        assert(second.misses == 2 and len(second) == 2)
+
+        # Results are stored in the members' own order, so the same members in another order are evaluated again
+        reordered = truss.truss.Truss()
+        reordered.remove_member(0)
+        reordered.add_member(*design.con[0])
+        reordered.change_member_size(reordered.m - 1, design.sizes[0] - reordered.sizes[-1])
+        second.evaluate(reordered)
+        assert(second.misses == 3 and np.isclose(reordered.fos[-1], results[1][0]))
+
+
+def test_store_drops_least_recently_used():
+    with tempfile.TemporaryDirectory() as directory:
+        store = heuristic_bursts.evaluation_store.EvaluationStore(os.path.join(directory, 'evaluations.sqlite'),
+                                                                  capacity=2)
+        store.trim_period = 1
+        store.put(b'a', 1)
+        store.put(b'b', 2)
+        assert(store.get(b'a') == 1)
+        store.put(b'c', 3)
+        assert(len(store) == 2)
+        assert(store.get(b'b') is None and store.get(b'a') == 1 and store.get(b'c') == 3)
@@ -0,0 +1,374 @@
+import truss.evaluation_cache
+import truss.rigidity
+import truss.truss
+
+import copy
+import numpy as np
+
+
+def build_design():
+    design = truss.truss.Truss()
+    design.add_joint([2.5, 4.5, 0])
+    design.add_member(3, 5)
+    design.add_member(4, 5)
+    design.add_joint([6.5, 2, 0])
+    design.add_member(1, 6)
+    design.add_member(4, 6)
+    design.change_member_size(2, -20)
+    design.change_member_size(5, 30)
+    return design
+
+
+def loop_stiffness(design):
+    # Member-by-member assembly, kept as the reference for the vectorized version
+    SS = np.zeros([3*design.n, 3*design.n])
+    for i in range(design.m):
+        H = design.con[i]
+        C = design.coord[H[1]] - design.coord[H[0]]
+        Le = np.linalg.norm(C)
+        T = C/Le
+        s = np.outer(T, T)
+        G = design.E*design.AREA_SEC[int(design.sizes[i])]/Le
+        ss = G*np.concatenate((np.concatenate((s, -s), axis=1), np.concatenate((-s, s), axis=1)), axis=0)
+        e = list(range(3*H[0], 3*H[0] + 3)) + list(range(3*H[1], 3*H[1] + 3))
+        for ii in range(6):
+            for j in range(6):
+                SS[e[ii], e[j]] += ss[ii, j]
+    return SS
+
+
+def matches_fresh_analysis(design):
+    # Member by member, apart from the round-off in the safety factors of members that carry no load
+    fresh = copy.deepcopy(design)
+    fresh.fos_eval()
+    loaded = fresh.fos < 1e6
+    return (np.allclose(design.fos[loaded], fresh.fos[loaded]) and np.all(design.fos[~loaded] >= 1e6) and
+            np.allclose(design.force, fresh.force, atol=1e-6))
+
+
+def test_vectorized_assembly_matches_loop():
+    design = build_design()
+    design.planar_analysis = False
+    D = design._analysis_data(np.ones([3, 2]))
+    H, T, Le, G = design._member_stiffness(D)
+    SS = design._assemble_stiffness(H, T, G, design.n)
+    assert(np.array_equal(SS, loop_stiffness(design)))
+
+    # The planar matrix is the same without the z degrees of freedom
+    design.planar_analysis = True
+    D = design._analysis_data(np.ones([3, 2]))
+    H, T, Le, G = design._member_stiffness(D)
+    SS = design._assemble_stiffness(H, T, G, design.n)
+    xy = np.arange(3*design.n) % 3 != 2
+    assert(np.array_equal(SS, loop_stiffness(design)[np.ix_(xy, xy)]))
+
+
+def test_sparse_solver_matches_dense():
+    dense = build_design()
+    dense.solver = 'dense'
+    dense.evaluate()
+    for renumber in [True, False]:
+        sparse = build_design()
+        sparse.solver = 'sparse'
+        sparse.renumber_joints = renumber
+        sparse.evaluate()
+        assert(np.allclose(sparse.force, dense.force, rtol=1e-8, atol=1e-3))
+        assert(np.isclose(min(sparse.fos), min(dense.fos), rtol=1e-8))
+
+
+def test_cholesky_solver_matches_dense():
+    dense = build_design()
+    dense.solver = 'dense'
+    dense.evaluate()
+    cholesky = build_design()
+    cholesky.solver = 'cholesky'
+    cholesky.evaluate()
+    assert(cholesky.stable)
+    assert(np.allclose(cholesky.force, dense.force, rtol=1e-8, atol=1e-3))
+
+
+def test_solvers_fall_back_to_dense_without_scipy():
+    dense = build_design()
+    dense.solver = 'dense'
+    dense.evaluate()
+    sps = truss.truss.sps
+    truss.truss.sps = None
+    try:
+        for solver in ['auto', 'cholesky', 'sparse']:
+            design = build_design()
+            design.solver = solver
+            design.evaluate()
+            assert(np.array_equal(design.force, dense.force))
+    finally:
+        truss.truss.sps = sps
+
+
+def test_mechanism_is_flagged_unstable():
+    for solver in ['dense', 'cholesky', 'sparse']:
+        design = build_design()
+        design.solver = solver
+        design.rigidity_check = False
+        design.add_joint([9, 4, 0])
+        design.add_member(6, 7)
+        design.evaluate()
+        assert(not design.stable)
+
+
+def test_low_rank_update_matches_full_solve():
+    design = build_design()
+    design.solver = 'cholesky'
+    design.evaluate()
+
+    candidate = copy.deepcopy(design)
+    candidate.change_member_size(3, 12)
+    candidate.move_joint(5, [0.3, -0.2, 0])
+    hits = design.reanalysis.hits
+    candidate.evaluate()
+    assert(candidate.reanalysis is design.reanalysis)
+    assert(design.reanalysis.hits == hits + 1)
+
+    reference = copy.deepcopy(candidate)
+    reference.low_rank_updates = False
+    reference.evaluate()
+    assert(np.allclose(candidate.force, reference.force, rtol=1e-8, atol=1e-3))
+
+
+def test_size_sweep_matches_single_evaluations():
+    design = build_design()
+    size_sets = np.array([design.sizes, np.ones(design.m)*10, np.linspace(0, 99, design.m).astype(int)])
+    mass, fos = design.evaluate_sizes(size_sets)
+    assert(mass.shape == (3,) and fos.shape == (3, design.m))
+    for k in range(len(size_sets)):
+        candidate = copy.deepcopy(design)
+        candidate.solver = 'dense'
+        for i in range(candidate.m):
+            candidate.change_member_size(i, size_sets[k, i] - candidate.sizes[i])
+        candidate.evaluate()
+        assert(np.isclose(mass[k], candidate.mass, rtol=1e-12))
+        assert(np.isclose(min(fos[k]), min(candidate.fos), rtol=1e-9))
+
+
+def test_load_cases_match_separate_evaluations():
+    load_cases = [{2: (0.0, -250000.0, 0.0)}, {2: (60000.0, -100000.0, 0.0)}, {2: (0.0, 150000.0, 0.0)}]
+    for solver in ['dense', 'cholesky', 'sparse']:
+        design = build_design()
+        design.solver = solver
+        design.load_cases = load_cases
+        design.evaluate()
+        assert(design.case_fos.shape == (3, design.m))
+        assert(np.array_equal(design.fos, np.min(design.case_fos, axis=0)))
+
+        for k in range(len(load_cases)):
+            single = build_design()
+            single.solver = solver
+            single.load_cases = [load_cases[k]]
+            single.evaluate()
+            # Members that carry no load have factors of safety set by round-off
+            assert(np.allclose(np.minimum(design.case_fos[k], 1e6), np.minimum(single.fos, 1e6), rtol=1e-8))
+
+    # Low-rank updates and size sweeps solve every load case too
+    candidate = copy.deepcopy(design)
+    candidate.change_member_size(3, 12)
+    hits = design.reanalysis.hits
+    candidate.evaluate()
+    assert(design.reanalysis.hits == hits + 1)
+    reference = copy.deepcopy(candidate)
+    reference.low_rank_updates = False
+    reference.evaluate()
+    assert(np.allclose(np.minimum(candidate.case_fos, 1e6), np.minimum(reference.case_fos, 1e6), rtol=1e-8))
+    _, fos = reference.evaluate_sizes([reference.sizes])
+    assert(np.allclose(np.minimum(fos[0], 1e6), np.minimum(reference.fos, 1e6), rtol=1e-8))
+
+    # A design has to be checked against at least one load case
+    reference.load_cases = []
+    try:
+        reference.evaluate()
+        assert(False)
+    except ValueError as error:
+        assert('load_cases' in str(error))
+
+
+def test_planar_analysis_matches_three_dimensional():
+    for solver in ['dense', 'cholesky', 'sparse']:
+        results = []
+        for planar in [True, False]:
+            design = build_design()
+            design.solver = solver
+            design.planar_analysis = planar
+            design.evaluate()
+            results.append(design)
+        assert(np.array_equal(results[0].fos, results[1].fos))
+        assert(np.array_equal(results[0].force, results[1].force))
+        assert(results[0].stable == results[1].stable)
+
+    # Designs that leave the plane are analysed in three dimensions
+    design = build_design()
+    design.move_joint(5, [0, 0, 0.5])
+    assert(len(design._analysis_data(np.ones([3, 2]))["Re"]) == 3)
+
+
+def test_evaluation_cache_reuses_repeated_designs():
+    design = build_design()
+    design.evaluate()
+    cache = design.evaluation_cache
+    hits, misses = cache.hits, cache.misses
+
+    # The same members added in another order, and a resize that leaves the size unchanged
+    candidate = copy.deepcopy(design)
+    candidate.remove_member(2)
+    candidate.add_member(*design.con[2])
+    candidate.change_member_size(candidate.m - 1, design.sizes[2] - candidate.sizes[-1])
+    candidate.change_member_size(0, 0)
+    candidate.evaluate()
+    assert(candidate.evaluation_cache is cache)
+    assert((cache.hits, cache.misses) == (hits + 1, misses))
+    assert(candidate.mass == design.mass)
+
+    assert(matches_fresh_analysis(candidate))
+
+    candidate.move_joint(5, [1e-9, 0, 0])
+    candidate.evaluate()
+    assert((cache.hits, cache.misses) == (hits + 1, misses + 1))
+
+    # Per-member results follow the members when a swap-remove and re-add reorders them
+    reordered = copy.deepcopy(design)
+    reordered.remove_member(0)
+    reordered.add_member(*design.con[0])
+    reordered.change_member_size(reordered.m - 1, design.sizes[0] - reordered.sizes[-1])
+    reordered.evaluate()
+    assert((cache.hits, cache.misses) == (hits + 2, misses + 1))
+    assert(matches_fresh_analysis(reordered))
+
+    # Least recently used designs are dropped first
+    cache = truss.evaluation_cache.EvaluationCache(2, quantum=1e-6)
+    designs = [build_design() for _ in range(3)]
+    designs[1].move_joint(5, [1e-9, 0, 0])
+    designs[2].move_joint(5, [0.5, 0, 0])
+    keys = [cache.key(d) for d in designs]
+    assert(keys[0] == keys[1] and keys[0] != keys[2])
+    cache.put(keys[0], 'a')
+    cache.put(keys[2], 'b')
+    assert(cache.get(keys[1]) == 'a')
+    cache.put(b'other', 'c')
+    assert(cache.get(keys[2]) is None and cache.get(keys[0]) == 'a')
+
+
+def test_sensitivities_match_finite_differences():
+    design = build_design()
+    dmass_dsize, dfos_dsize, dmass_dcoord, dfos_dcoord = design.sensitivities()
+    size = int(design.sizes[5])
+    length = np.linalg.norm(design.coord[design.con[5, 1]] - design.coord[design.con[5, 0]])
+    assert(np.isclose(dmass_dsize[5], design.WEIGHT[size]*2/(design.OUTER_DIAM[size]*1000)*length))
+
+    for joint in (5, 6):
+        for axis in range(2):
+            step = np.zeros(3)
+            step[axis] = 1e-6
+            results = []
+            for sign in (1, -1):
+                candidate = copy.deepcopy(design)
+                candidate.move_joint(joint, sign*step)
+                candidate.evaluate()
+                results.append((candidate.mass, np.min(candidate.fos)))
+            assert(np.isclose((results[0][0] - results[1][0])/2e-6, dmass_dcoord[joint, axis], rtol=1e-5))
+            assert(np.isclose((results[0][1] - results[1][1])/2e-6, dfos_dcoord[joint, axis], rtol=1e-4, atol=1e-8))
+
+
+def test_gradient_resize_raises_lowest_fos():
+    design = build_design()
+    design.gradient_rules = True
+    for member in range(design.m):
+        design.change_member_size(member, -design.sizes[member] + 5)
+    design.evaluate()
+    fos = np.min(design.fos)
+    assert(fos < design.target_fos)
+
+    design.lowtier_rule_perform(7)
+    design.evaluate()
+    assert(np.min(design.fos) > fos)
+
+    # A member without mass, as a zero-length one would be, is left out rather than divided by
+    dmass_dsize, dfos_dsize, dmass_dcoord, dfos_dcoord = design.sensitivities()
+    dmass_dsize[0] = 0.0
+    dfos_dsize[0] = 1.0
+    design.sensitivities = lambda: (dmass_dsize, dfos_dsize, dmass_dcoord, dfos_dcoord)
+    with np.errstate(all='raise'):
+        for _ in range(20):
+            resize = design._descent_resize(0, len(design.AREA_SEC) - 1)
+            assert(resize is None or resize[0] != 0)
+
+
+def test_fully_stressed_design_is_feasible_and_tight():
+    design = build_design()
+    design.evaluate()
+    mass = design.mass
+
+    design.hightier_rule_perform(6)
+    design.evaluate()
+    assert(design.applied_rules[-1] == 'H6')
+    assert(np.min(design.fos) >= design.target_fos and design.mass < mass)
+
+    # No member can take the next smaller size and stay at the target factor of safety
+    sizes = design.sizes.astype(int)
+    members = np.nonzero(sizes > 1)[0]
+    smaller = np.tile(sizes, (len(members), 1))
+    smaller[np.arange(len(members)), members] -= 1
+    _, fos = design.evaluate_sizes(smaller)
+    assert(np.all(fos[np.arange(len(members)), members] < design.target_fos))
+
+
+def test_topology_data_is_kept_until_topology_changes():
+    design = build_design()
+    design.evaluate()
+    topology = design._topology
+
+    # Resizing members and moving joints only redo the numeric work
+    candidate = copy.deepcopy(design)
+    candidate.change_member_size(0, 3)
+    candidate.move_joint(5, [0.1, 0.2, 0])
+    candidate.evaluate()
+    assert(candidate._topology is topology)
+    fresh = copy.deepcopy(candidate)
+    fresh._topology = None
+    fresh.fos_eval()
+    assert(np.array_equal(fresh.fos, candidate.fos) and fresh._topology is not topology)
+
+    # New load cases and new members are picked up
+    candidate.load_cases.append({5: (50000.0, 0.0, 0.0)})
+    candidate.evaluate()
+    assert(candidate._topology is not topology and len(candidate.case_fos) == 2)
+    candidate.add_member(0, 5)
+    assert(candidate._topology is None and design._topology is topology)
+
+
+def test_mechanisms_are_rejected_before_analysis():
+    assert(truss.rigidity.independent_members(3, [(0, 1), (1, 2), (0, 2)]) == 3)
+    assert(truss.rigidity.independent_members(4, [(0, 1), (0, 2), (0, 3), (1, 2), (1, 3), (2, 3)]) == 5)
+    assert(not truss.rigidity.connected(4, [(0, 1), (2, 3)], [0]))
+
+    # A hanging member, a four-bar linkage that has as many members as a rigid truss because one of them joins the
+    # supports, and a second piece that is rigid on its own but not held
+    hanging = build_design()
+    hanging.add_joint([9, 4, 0])
+    hanging.add_member(6, 7)
+    linkage = truss.truss.Truss()
+    linkage.remove_member(5)
+    linkage.remove_member(4)
+    linkage.add_member(0, 1)
+    floating = build_design()
+    for xy in [[8, 0, 0], [9, 0, 0], [8.5, 1, 0]]:
+        floating.add_joint(xy)
+    for a, b in [(7, 8), (8, 9), (7, 9)]:
+        floating.add_member(a, b)
+
+    for design in [hanging, linkage, floating]:
+        design.evaluate()
+        reference = copy.deepcopy(design)
+        reference.rigidity_check = False
+        reference.fos_eval()
+        assert(design._is_mechanism() and not design.stable and not reference.stable)
+        assert(np.all(design.force == pow(10, 16)))
+
+    design = build_design()
+    design.evaluate()
+    assert(not design._is_mechanism() and design.stable)
@@ -0,0 +1,116 @@
+import truss.geometry
+import truss.truss
+
+import copy
+import random
+import numpy as np
+
+
+def test_segment_cases():
+    cases = [
+        # Crossing members
+        ([0, 0], [2, 2], [0, 2], [2, 0], True),
+        # One member ends on the other
+        ([0, 0], [2, 0], [1, 0], [1, 2], False),
+        # Crossing within rounding distance of an end
+        ([0, 0], [2, 0], [1, -0.000001], [1, 2], False),
+        # Parallel members
+        ([0, 0], [2, 0], [0, 1], [2, 1], False),
+        # Collinear members that overlap, that touch and that are apart
+        ([0, 0], [2, 0], [1, 0], [3, 0], True),
+        ([0, 0], [0, 2], [0, 1], [0, 3], True),
+        ([0, 0], [2, 0], [2, 0], [3, 0], False),
+        ([0, 0], [2, 0], [2.5, 0], [3, 0], False),
+    ]
+    for a, b, c, d, expected in cases:
+        assert(bool(truss.geometry.segments_intersect(a, b, c, d)) == expected)
+        assert(bool(truss.geometry.segments_intersect(c, d, a, b)) == expected)
+
+    # End points broadcast against each other
+    c = np.array([[0, 2], [0, 1], [5, 2]])
+    d = np.array([[2, 0], [2, 1], [6, 0]])
+    assert(list(truss.geometry.segments_intersect([0, 0], [2, 2], c, d)) == [True, True, False])
+
+
+def test_crossing_members():
+    design = truss.truss.Truss()
+    assert(design.is_valid() and len(design.crossing_members()) == 0)
+
+    design.add_member(0, 4)
+    pairs = design.crossing_members()
+    assert(not design.is_valid())
+    assert(sorted(map(tuple, pairs)) == [(4, 7)])
+
+
+def test_delta_validity_matches_full_check():
+    random.seed(5)
+    design = truss.truss.Truss()
+    assert(design.is_valid())
+    for _ in range(300):
+        candidate = copy.deepcopy(design)
+        action = random.randint(0, 5)
+        if action < 2 or candidate.n < 7:
+            candidate.add_joint([random.uniform(-2, 7), random.uniform(-2, 5), 0])
+            for joint in random.sample(range(candidate.n - 1), 2):
+                candidate.add_member(joint, candidate.n - 1)
+        elif action == 2:
+            candidate.remove_joint(random.randint(3, candidate.n - 1))
+        elif action == 3 and candidate.m > 0:
+            candidate.remove_member(random.randint(0, candidate.m - 1))
+        else:
+            candidate.move_joint(random.randint(3, candidate.n - 1), [random.uniform(-1, 1), random.uniform(-1, 1), 0])
+
+        full = copy.deepcopy(candidate).is_valid(full=True)
+        assert(candidate.is_valid() == full)
+        if full:
+            design = candidate
+
+
+def test_visible_joints_match_crossed_members():
+    random.seed(3)
+    design = truss.truss.Truss()
+    points = [[random.uniform(-2, 7), random.uniform(-2, 5), 0] for _ in range(50)]
+    points += [(design.coord[a] + design.coord[b])/2 for a, b in design.con]
+    for point in points:
+        expected = [joint for joint in range(design.n) if len(design.crossed_members(point, design.coord[joint])) == 0]
+        assert(design.visible_joints(point) == expected)
+
+
+def test_free_travel_cases():
+    # A joint at the origin with a member down to (0, -1), moved to the right
+    point, step, ends = [0, 0], [2, 0], [[0, -1]]
+    cases = [
+        # The joint reaches a member halfway
+        ([1, -2], [1, 2], 0.5),
+        # An end of a member is reached by the moving member
+        ([0.3, -0.25], [0.3, -3], 0.2),
+        # A member that is never reached, and one on the other side
+        ([0, 1], [3, 1], 1.0),
+        ([-1, -2], [-1, 2], 1.0),
+        # A member that ends on the moving one only blocks the move if it is on the side the member moves into
+        ([0, -0.5], [1, -0.5], 0.0),
+        ([0, -0.5], [-1, -0.5], 1.0),
+    ]
+    for a, b, expected in cases:
+        travel = truss.geometry.free_travel(point, step, ends, [a], [b], np.zeros([1, 1], dtype=bool))
+        assert(np.isclose(travel, expected))
+    assert(truss.geometry.free_travel(point, step, ends, [[1, -2]], [[1, 2]], np.ones([1, 1], dtype=bool)) == 1.0)
+
+
+def test_moved_joints_stay_valid():
+    random.seed(3)
+    design = truss.truss.Truss()
+    for _ in range(12):
+        design.lowtier_rule_perform(3)
+    assert(design.is_valid(full=True))
+
+    for _ in range(100):
+        joint = design.moveable_joints[random.randint(0, len(design.moveable_joints) - 1)]
+        step = [random.uniform(-3, 3), random.uniform(-3, 3), 0]
+        scale = random.uniform(0, design.joint_travel(joint, step))
+        candidate = copy.deepcopy(design)
+        candidate.move_joint(joint, [scale*x for x in step])
+        assert(candidate.is_valid(full=True))
+
+        design.lowtier_rule_perform(6)
+        assert(design.is_valid(full=True))
@@ -0,0 +1,80 @@
+import os
+import sys
+
+# Run from anywhere, with the repository root on the path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+import truss.evaluation_cache
+import truss.truss
+
+import time
+
+
+def lattice_truss(panels):
+    # Pratt-style girder with the supports at joints 0 and 1 and the load at joint 2
+    design = truss.truss.Truss()
+    span = 2.5*panels
+    while design.m > 0:
+        design.remove_member(design.m - 1)
+    design.remove_joint(4)
+    design.remove_joint(3)
+    design.move_joint(1, [span - 5.0, 0, 0])
+    design.move_joint(2, [2.5*(panels//2) - 2.5, 0, 0])
+
+    # Bottom chord, top chord and panel points
+    bottom = []
+    for i in range(panels + 1):
+        if i == 0:
+            bottom.append(0)
+        elif i == panels:
+            bottom.append(1)
+        elif i == panels//2:
+            bottom.append(2)
+        else:
+            design.add_joint([2.5*i, 0, 0])
+            bottom.append(design.n - 1)
+    top = []
+    for i in range(panels + 1):
+        design.add_joint([2.5*i, 3.0, 0])
+        top.append(design.n - 1)
+
+    for i in range(panels):
+        design.add_member(bottom[i], bottom[i + 1])
+        design.add_member(top[i], top[i + 1])
+        design.add_member(bottom[i], top[i])
+        if i < panels//2:
+            design.add_member(top[i], bottom[i + 1])
+        else:
+            design.add_member(bottom[i], top[i + 1])
+    design.add_member(bottom[panels], top[panels])
+
+    return design
+
+
+def time_evaluation(design, solver, repeats):
+    # Every repeat has to solve, so neither the results of the last evaluation nor its factorization are reused
+    design.solver = solver
+    design.evaluation_cache = truss.evaluation_cache.EvaluationCache(0)
+    design.low_rank_updates = False
+    start = time.time()
+    for _ in range(repeats):
+        design.evaluate()
+    return (time.time() - start)/repeats
+
+
+def run_benchmark():
+    # 'auto' picks Cholesky for small designs, so the threshold is where the sparse solver overtakes it
+    print('%8s %8s %14s %12s' % ('joints', 'members', 'cholesky (ms)', 'sparse (ms)'))
+    crossover = None
+    for panels in [4, 8, 16, 24, 32, 48, 56, 64, 72, 80, 96, 128, 192, 256]:
+        design = lattice_truss(panels)
+        repeats = max(1, int(2000/design.n))
+        cholesky = time_evaluation(design, 'cholesky', repeats)
+        sparse = time_evaluation(design, 'sparse', repeats)
+        if crossover is None and sparse < cholesky:
+            crossover = design.n
+        print('%8d %8d %14.3f %12.3f' % (design.n, design.m, 1000*cholesky, 1000*sparse))
+    print('Sparse solver is faster than Cholesky from about %s joints' % crossover)
+
+if __name__ == '__main__':
+    run_benchmark()
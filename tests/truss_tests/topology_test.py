@@ -0,0 +1,165 @@
+import truss.geometry
+import truss.rule_sets
+import truss.segment_grid
+import truss.truss
+
+import copy
+import random
+import numpy as np
+
+
+def connectivity_from_members(design):
+    con_mat = np.zeros([design.n, design.n])
+    for member in design.con:
+        con_mat[member[0], member[1]] = 1.0
+        con_mat[member[1], member[0]] = 1.0
+    return con_mat
+
+
+def test_storage_stays_consistent_under_edits():
+    random.seed(3)
+    design = truss.truss.Truss()
+    grid = design.segment_grid()
+    for _ in range(200):
+        action = random.randint(0, 3)
+        if action == 0 or design.n < 6:
+            design.add_joint([random.uniform(-5, 10), random.uniform(-5, 10), 0])
+            for joint in random.sample(range(design.n - 1), 2):
+                design.add_member(joint, design.n - 1)
+        elif action == 1:
+            design.remove_joint(random.randint(3, design.n - 1))
+        elif action == 2 and design.m > 0:
+            design.remove_member(random.randint(0, design.m - 1))
+        else:
+            design.move_joint(random.randint(0, design.n - 1), [0.1, -0.2, 0])
+
+        assert(design.coord.shape == (design.n, 3))
+        assert(design.con.shape == (design.m, 2) and design.sizes.shape == (design.m,))
+        assert(np.all(design.con < design.n))
+        assert(np.array_equal(design.con_mat, connectivity_from_members(design)))
+        for i in range(design.m):
+            assert(design.member_index(design.con[i][1], design.con[i][0]) == i)
+        for j in range(design.n):
+            assert(design.degree(j) == np.sum(design.con == j))
+
+        # The segment grid follows the edits
+        assert(design.segment_grid() is grid)
+        rebuilt = truss.segment_grid.SegmentGrid(design.coord, design.con, grid.cell_size)
+        assert(grid.cells == rebuilt.cells)
+        assert(np.array_equal(design.crossing_members(), truss.geometry.crossing_members(design.coord, design.con)))
+
+
+def test_member_lookup_and_degree():
+    design = truss.truss.Truss()
+    assert(design.member_index(2, 3) == 4 and design.member_index(3, 2) == 4)
+    assert(design.member_index(0, 1) is None)
+    assert(design.neighbors(2) == {0, 1, 3, 4} and design.degree(3) == 3)
+
+    design.remove_member(1)
+    assert(design.member_index(1, 2) is None and design.member_index(3, 4) == 1)
+    assert(design.degree(2) == 3)
+
+
+def test_remove_joint_moves_last_joint_into_its_place():
+    design = truss.truss.Truss()
+    design.add_joint([6, 3, 0])
+    design.add_member(4, 5)
+    design.add_member(1, 5)
+    last_coord = design.coord[5].copy()
+
+    design.remove_joint(3)
+    assert(design.n == 5)
+    assert(np.array_equal(design.coord[3], last_coord))
+    members = set(tuple(sorted(member)) for member in design.con)
+    assert((3, 4) in members and (1, 3) in members)
+
+
+def test_copy_shares_storage_until_edited():
+    design = truss.truss.Truss()
+    design.rule_check()
+    candidate = copy.deepcopy(design)
+    assert(candidate.coord is not design.coord and np.shares_memory(candidate.coord, design.coord))
+
+    coord = design.coord.copy()
+    candidate.move_joint(3, [0.5, 0.5, 0])
+    candidate.add_joint([6, 3, 0])
+    candidate.add_member(4, 5)
+    candidate.change_member_size(0, 10)
+    assert(not np.shares_memory(candidate.coord, design.coord))
+    assert(np.array_equal(design.coord, coord) and design.n == 5 and design.m == 7)
+    assert(np.all(design.sizes == 50.0))
+    assert(candidate.n == 6 and candidate.m == 8)
+    assert(np.array_equal(candidate.con_mat, connectivity_from_members(candidate)))
+
+    # Edits to the original after copying leave the copy alone as well
+    other = copy.deepcopy(design)
+    design.remove_joint(3)
+    assert(other.n == 5 and np.array_equal(other.coord, coord))
+    assert(np.array_equal(other.con_mat, connectivity_from_members(other)))
+
+
+def rule_sets(design):
+    design.rule_check()
+    return (design.deletable_joints, [list(joinable_set) for joinable_set in design.joinable_sets],
+            [(member[0], list(member[1]), member[2]) for member in design.re_diagonable_members],
+            [(list(pattern[0]), pattern[1], pattern[2]) for pattern in design.patterns], design.moveable_joints)
+
+
+def test_rule_sets_follow_edits():
+    random.seed(8)
+    designs = [truss.truss.Truss()]
+    designs[0].rule_check()
+    for _ in range(150):
+        design = random.choice(designs)
+        if random.random() < 0.3:
+            design = copy.deepcopy(design)
+            designs.append(design)
+
+        action = random.randint(0, 5)
+        if action < 2 or design.n < 7:
+            design.add_joint([random.uniform(-2, 7), random.uniform(-2, 5), 0])
+            for joint in random.sample(range(design.n - 1), 3):
+                design.add_member(joint, design.n - 1)
+        elif action == 2:
+            design.remove_joint(random.randint(3, design.n - 1))
+        elif action == 3 and design.m > 0:
+            design.remove_member(random.randint(0, design.m - 1))
+        else:
+            design.move_joint(random.randint(3, design.n - 1), [random.uniform(-1, 1), random.uniform(-1, 1), 0])
+
+        # Sets kept up to date through the edits match sets found from scratch
+        if random.random() < 0.5:
+            rebuilt = copy.deepcopy(design)
+            rebuilt._rule_sets = None
+            assert(rule_sets(design) == rule_sets(rebuilt))
+
+
+def test_rule_sets_are_only_found_when_read():
+    design = truss.truss.Truss()
+    design.lowtier_rule_perform(7, member=0, size=20)
+    design.lowtier_rule_perform(6, joint=3, d_coord=[0.1, 0.1, 0])
+    assert(design._rule_sets.pending('pattern') and design._rule_sets.pending('joinable'))
+
+    patterns = design.patterns
+    assert(not design._rule_sets.pending('pattern') and design._rule_sets.pending('joinable'))
+    assert(design.patterns is patterns)
+    design.move_joint(4, [0.1, 0, 0])
+    assert(design.patterns is not patterns)
+
+
+def test_common_neighbors_and_reflections():
+    design = truss.truss.Truss()
+    pairs = [(i, j) for i in range(design.n) for j in range(i + 1, design.n)]
+    expected = [sorted(design.neighbors(i) & design.neighbors(j)) for i, j in pairs]
+    sparse_pairs = truss.rule_sets.sparse_pairs
+    try:
+        truss.rule_sets.sparse_pairs = 0
+        assert(truss.rule_sets.common_neighbors(design, pairs) == expected)
+    finally:
+        truss.rule_sets.sparse_pairs = sparse_pairs
+
+    a = np.array([[0, 0, 0], [0, 0, 0], [1, 1, 0], [2, 0, 0]])
+    b = np.array([[2, 0, 0], [0, 2, 0], [3, 3, 0], [2, 0, 0]])
+    c = np.array([[1, 1, 0], [1, 1, 0], [1, 2, 0], [1, 1, 0]])
+    expected = np.array([[1, -1, 0], [-1, 1, 0], [2, 1, 0], [3, -1, 0]])
+    assert(np.allclose(truss.rule_sets.reflect(a, b, c), expected))
@@ -0,0 +1,65 @@
+import collections
+import hashlib
+import numpy as np
+
+
+class EvaluationCache(object):
+    """Results of recently evaluated trusses, so that candidates which repeat an earlier design are not analysed
+    again. Designs are keyed by a hash of their joints, their members as a set of (joint, joint, size) triples and
+    everything else the analysis depends on. The least recently used design is dropped once capacity is reached.
+    Per-member results are stored in the key's member order, which member_order gives for a design."""
+
+    def __init__(self, capacity, quantum=None):
+        self.capacity = capacity
+
+        # Joint coordinates are rounded to multiples of quantum in the key when it is set, so that designs which
+        # differ only by round-off share their results
+        self.quantum = quantum
+
+        self.hits = 0
+        self.misses = 0
+        self.results = collections.OrderedDict()
+
+    def clear(self):
+        self.results.clear()
+
+    @staticmethod
+    def member_order(design):
+        # Members sorted by their lower joint, then their upper joint, so the order they were added in does not matter
+        ends = np.sort(design.con, axis=1)
+        return np.lexsort((ends[:, 1], ends[:, 0]))
+
+    def key(self, design, order=None):
+        coord = design.coord
+        if self.quantum is not None:
+            coord = np.round(coord/self.quantum).astype(np.int64)
+
+        # Members are listed with their lower joint first, in the given order or else the canonical one
+        ends = np.sort(design.con, axis=1)
+        if order is None:
+            order = self.member_order(design)
+
+        h = hashlib.sha1()
+        h.update(np.ascontiguousarray(coord).tobytes())
+        h.update(np.ascontiguousarray(ends[order]).tobytes())
+        h.update(np.ascontiguousarray(design.sizes[order]).tobytes())
+        h.update(repr((design.n, design.load_cases, design.fixed_joints, design.force_joints, design.solver,
+                       design.planar_analysis, design.low_rank_updates)).encode())
+        return h.digest()
+
+    def get(self, key):
+        result = self.results.get(key)
+        if result is None:
+            self.misses += 1
+            return None
+        self.results.move_to_end(key)
+        self.hits += 1
+        return result
+
+    def put(self, key, result):
+        if self.capacity <= 0:
+            return
+        self.results[key] = result
+        self.results.move_to_end(key)
+        while len(self.results) > self.capacity:
+            self.results.popitem(last=False)
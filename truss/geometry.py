@@ -0,0 +1,163 @@
+import numpy as np
+
+# Members that meet within this distance of one of their ends, in both x and y, are taken to share a joint
+rounding_error = 0.000005
+
+# Number of members tested against all others at a time in crossing_members, to bound memory on large designs
+block_size = 256
+
+# Margin, in radians, added to the angular extent of members when pairing them with sight lines in visible_points
+angular_tolerance = 1e-9
+
+
+def orientation(p, q, r):
+    # Twice the signed area of triangle p, q, r; positive when r lies to the left of p->q
+    return (q[..., 0] - p[..., 0])*(r[..., 1] - p[..., 1]) - (q[..., 1] - p[..., 1])*(r[..., 0] - p[..., 0])
+
+
+def segments_intersect(a, b, c, d):
+    """Tests members a-b against members c-d in the xy plane. The end points are arrays of shape (..., 2) or
+    (..., 3) that broadcast against each other, and the result is a boolean array of the broadcast shape."""
+    a, b, c, d = [np.asarray(point, dtype=float)[..., :2] for point in (a, b, c, d)]
+    o1 = orientation(a, b, c)
+    o2 = orientation(a, b, d)
+    o3 = orientation(c, d, a)
+    o4 = orientation(c, d, b)
+
+    # Members that cross each other, unless the crossing is at one of their ends
+    crossing = (o1*o2 < 0) & (o3*o4 < 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = o3/(o3 - o4)
+        point = a + t[..., np.newaxis]*(b - a)
+    for end in (a, b, c, d):
+        crossing &= ~np.all(abs(point - end) < rounding_error, axis=-1)
+
+    # Collinear members that overlap along more than a single point
+    u = b - a
+    s_c = np.sum((c - a)*u, axis=-1)
+    s_d = np.sum((d - a)*u, axis=-1)
+    overlap = np.maximum(np.minimum(s_c, s_d), 0.0) < np.minimum(np.maximum(s_c, s_d), np.sum(u*u, axis=-1))
+
+    return crossing | ((o1 == 0) & (o2 == 0) & overlap)
+
+
+def visible_points(point, targets, a, b):
+    """Tests which targets can be joined to point without crossing any of the members a-b. A sight line can only
+    cross a member whose angular extent, seen from point, covers the target's direction, so the sight lines are
+    sorted by direction and only the pairs found that way are tested, all at once."""
+    point = np.asarray(point, dtype=float)[:2]
+    targets = np.asarray(targets, dtype=float)[:, :2]
+    a = np.asarray(a, dtype=float)[:, :2]
+    b = np.asarray(b, dtype=float)[:, :2]
+
+    direction = np.arctan2(targets[:, 1] - point[1], targets[:, 0] - point[0])
+    order = np.argsort(direction)
+    direction = direction[order]
+
+    # Angular extent of each member, widened a little so that rounding never drops a pair
+    angle_a = np.arctan2(a[:, 1] - point[1], a[:, 0] - point[0])
+    angle_b = np.arctan2(b[:, 1] - point[1], b[:, 0] - point[0])
+    span = np.mod(angle_b - angle_a + np.pi, 2*np.pi) - np.pi
+    low = angle_a + np.minimum(span, 0.0) - angular_tolerance
+    high = angle_a + np.maximum(span, 0.0) + angular_tolerance
+
+    # Members on a line through point can be seen in opposite directions, so they are tested against every target
+    length = np.sqrt(np.sum((b - a)**2, axis=-1))
+    through = abs(orientation(a, b, point)) <= rounding_error*length
+    low[through] = -2*np.pi
+    high[through] = 2*np.pi
+
+    # Extents that wrap past +-pi are tested again on the other side
+    below = low < -np.pi
+    above = high > np.pi
+    members = np.concatenate([np.arange(len(a)), np.nonzero(below)[0], np.nonzero(above)[0]])
+    low, high = (np.concatenate([low, low[below] + 2*np.pi, np.full(np.count_nonzero(above), -np.pi)]),
+                 np.concatenate([high, np.full(np.count_nonzero(below), np.pi), high[above] - 2*np.pi]))
+
+    # Every (sight line, member) pair with the sight line inside the member's extent
+    first = np.searchsorted(direction, low, side='left')
+    count = np.maximum(np.searchsorted(direction, high, side='right') - first, 0)
+    pair_member = np.repeat(members, count)
+    pair_target = order[np.arange(np.sum(count)) - np.repeat(np.cumsum(count) - count, count) + np.repeat(first, count)]
+
+    visible = np.ones(len(targets), dtype=bool)
+    hit = segments_intersect(point, targets[pair_target], a[pair_member], b[pair_member])
+    visible[pair_target[hit]] = False
+    return visible
+
+
+def crossing_members(coord, con, pairs=None):
+    """Returns the index pairs (i, j), i < j, of members that intersect, ignoring members that share a joint. When
+    pairs is given only those candidate pairs are tested."""
+    coord = np.asarray(coord, dtype=float)
+    con = np.asarray(con, dtype=int).reshape(-1, 2)
+    a = coord[con[:, 0]]
+    b = coord[con[:, 1]]
+
+    if pairs is not None:
+        pairs = np.asarray(pairs, dtype=int).reshape(-1, 2)
+        return pairs[_crossing(con, a, b, pairs[:, 0], pairs[:, 1])]
+
+    found = []
+    for start in range(0, len(con), block_size):
+        i = np.arange(start, min(start + block_size, len(con)))[:, np.newaxis]
+        j = np.arange(len(con))[np.newaxis, :]
+        rows, columns = np.nonzero((j > i) & _crossing(con, a, b, i, j))
+        found.append(np.column_stack([rows + start, columns]))
+
+    if len(found) == 0:
+        return np.zeros([0, 2], dtype=int)
+    return np.concatenate(found)
+
+
+def _crossing(con, a, b, i, j):
+    shared = (con[i, 0] == con[j, 0]) | (con[i, 0] == con[j, 1]) | (con[i, 1] == con[j, 0]) | \
+        (con[i, 1] == con[j, 1])
+    return ~shared & segments_intersect(a[i], b[i], a[j], b[j])
+
+
+def free_travel(point, step, ends, a, b, excluded):
+    """Returns the fraction, at most one, of the displacement step that point can be moved by before any of the
+    segments from point to ends crosses one of the members a-b. excluded masks the (segment, member) pairs that
+    share a joint. Every position short of the returned fraction keeps the segments clear of the members, so they
+    form a star-shaped region around point that displacements can be sampled from without testing them again."""
+    p = np.asarray(point, dtype=float)[:2]
+    v = np.asarray(step, dtype=float)[:2]
+    q = np.asarray(ends, dtype=float)[:, np.newaxis, :2]
+    a = np.asarray(a, dtype=float)[np.newaxis, :, :2]
+    b = np.asarray(b, dtype=float)[np.newaxis, :, :2]
+
+    # Contact starts either with point reaching a member, or with an end of a member reaching one of the segments.
+    # Both happen where an orientation that is linear in the fraction moved changes sign.
+    u = b - a
+    r = p - q
+    moved = lambda t: t[..., np.newaxis]*v
+    events = [_contact(orientation(a, b, p), u[..., 0]*v[1] - u[..., 1]*v[0], np.sqrt(np.sum(u*u, axis=-1)),
+                       lambda t: _between(np.sum((p + moved(t) - a)*u, axis=-1), np.sum(u*u, axis=-1)),
+                       orientation(a, b, q))]
+    for c, other in ((a, b), (b, a)):
+        w = c - q
+        events.append(_contact(orientation(q, p, c), v[0]*w[..., 1] - v[1]*w[..., 0], np.sqrt(np.sum(r*r, axis=-1)),
+                               lambda t, w=w: _between(np.sum(w*(r + moved(t)), axis=-1),
+                                                       np.sum((r + moved(t))**2, axis=-1)),
+                               orientation(q, p, other)))
+
+    times = np.broadcast_to(np.minimum(events[0], np.minimum(events[1], events[2])), excluded.shape)
+    times = times[~excluded]
+    return min(1.0, np.min(times)) if len(times) > 0 else 1.0
+
+
+def _between(position, length):
+    return (position >= 0) & (position <= length)
+
+
+def _contact(start, rate, length, inside, far_side):
+    # Fraction moved at which an orientation start + t*rate reaches zero, for a segment of the given length, with
+    # inside(t) telling whether the contact is within both segments then. A contact that is already touching only
+    # blocks the move if it turns the members across each other, which depends on the side of the far end.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = -start/rate
+        times = np.where(inside(t) & (t > 0), t, np.inf)
+        touching = (abs(start) <= rounding_error*length) & inside(np.zeros(np.shape(t)))
+        crossing = rate*far_side < 0
+    return np.where(touching, np.where(crossing, 0.0, np.inf), times)
@@ -0,0 +1,118 @@
+import numpy as np
+
+
+class Reanalysis(object):
+    """Keeps the factorized stiffness matrix of a reference truss so that designs which differ from it in only a
+    few members can be solved with a Sherman-Morrison-Woodbury update instead of a new factorization."""
+
+    # Largest relative residual accepted from an updated solution
+    residual_tolerance = pow(10, -8)
+
+    # Condition number above which a design counts as a near-mechanism
+    max_condition = pow(10, 10)
+
+    def __init__(self, max_rank):
+        self.max_rank = max_rank
+        self.hits = 0
+        self.misses = 0
+        self.clear()
+
+    def clear(self):
+        self.con = None
+        self.ff = None
+        self.load = None
+        self.T = None
+        self.G = None
+        self.K = None
+        self.K_norm = 0.0
+        self.K_inv_norm = 0.0
+        self.factor_solve = None
+        self.U = None
+
+    def store(self, D, ff, load, T, G, K, factor_solve, rcond, U):
+        # Only well-conditioned designs make a useful reference, so near-mechanisms keep the previous one
+        if rcond * self.max_condition < 1.0:
+            return
+        self.con = np.array(D["Con"], dtype=int)
+        self.ff = ff.copy()
+        self.load = np.array(load)
+        self.T = T.copy()
+        self.G = G.copy()
+        self.K = K
+        self.K_norm = abs(K).sum(axis=0).max()
+        self.K_inv_norm = 1.0/(rcond*self.K_norm)
+        self.factor_solve = factor_solve
+        self.U = U.copy()
+
+    def solve(self, D, ff, load, T, G):
+        """Returns the free displacements of the design described by D, or None when it cannot be reached from
+        the reference with a safe low-rank update."""
+        if not self._same_topology(D, ff, load):
+            self.misses += 1
+            return None
+
+        # Members whose stiffness changed, either through their size or through their direction and length
+        moved = np.any(T != self.T, axis=0)
+        resized = (G != self.G) & ~moved
+        if 2*np.count_nonzero(moved) + np.count_nonzero(resized) > self.max_rank:
+            self.misses += 1
+            return None
+        if not np.any(moved) and not np.any(resized):
+            self.hits += 1
+            return self.U.copy()
+
+        # Each element matrix is G*v*v' with v = [T, -T] on the member's degrees of freedom, so the change in the
+        # free-DOF stiffness matrix is W*diag(c)*W'
+        position = -np.ones(np.size(D["Re"]), dtype=int)
+        position[ff] = np.arange(len(ff))
+        columns = []
+        c = []
+        for i in np.where(moved)[0]:
+            columns.append(self._dof_vector(i, self.T[:, i], position, len(ff)))
+            c.append(-self.G[i])
+            columns.append(self._dof_vector(i, T[:, i], position, len(ff)))
+            c.append(G[i])
+        for i in np.where(resized)[0]:
+            columns.append(self._dof_vector(i, T[:, i], position, len(ff)))
+            c.append(G[i] - self.G[i])
+        W = np.column_stack(columns)
+        c = np.array(c)
+
+        # Woodbury identity, using the reference factorization for every solve
+        Y = self.factor_solve(W)
+        S = np.diag(1.0/c) + W.T.dot(Y)
+        try:
+            S_inv = np.linalg.inv(S)
+        except np.linalg.LinAlgError:
+            self.misses += 1
+            return None
+        U = self.U - Y.dot(S_inv.dot(W.T.dot(self.U)))
+
+        # Reject updates that lost accuracy to cancellation
+        residual = self.K.dot(U) + W.dot((c*W.T.dot(U).T).T) - load
+        if np.linalg.norm(residual) > self.residual_tolerance*np.linalg.norm(load):
+            self.misses += 1
+            return None
+
+        # Upper bound on the 1-norm condition number of the updated matrix. Designs that might be near-mechanisms
+        # are left to a full solve, which estimates the condition number properly.
+        norm = self.K_norm + np.sum(abs(c)*abs(W).sum(axis=0)*abs(W).max(axis=0))
+        inv_norm = self.K_inv_norm + abs(Y).sum(axis=0).max()*abs(S_inv).sum(axis=0).max()*abs(Y).sum(axis=1).max()
+        if norm*inv_norm > self.max_condition:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return U
+
+    def _same_topology(self, D, ff, load):
+        return self.con is not None and np.shape(D["Con"]) == self.con.shape and np.array_equal(D["Con"], self.con) \
+            and np.array_equal(ff, self.ff) and np.array_equal(load, self.load)
+
+    def _dof_vector(self, i, T, position, size):
+        v = np.zeros(size)
+        for end, sign in [(0, 1.0), (1, -1.0)]:
+            dofs = position[len(T)*self.con[end, i] + np.arange(len(T))]
+            free = dofs >= 0
+            v[dofs[free]] = sign*T[free]
+        return v
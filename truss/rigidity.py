@@ -0,0 +1,95 @@
+import numpy as np
+
+
+def connected(n, con, joints):
+    """Tests whether every one of the n joints is joined to the given joints through the members con, using
+    union-find with path halving."""
+    parent = list(range(n))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for a, b in con:
+        parent[find(a)] = find(b)
+    for a in joints[1:]:
+        parent[find(a)] = find(joints[0])
+
+    root = find(joints[0])
+    return all(find(i) == root for i in range(n))
+
+
+def independent_members(n, con):
+    """Counts the members of a planar framework on n joints that are independent in the generic sense, with the
+    (2, 3) pebble game: every joint holds two pebbles, and a member is independent when four pebbles can be
+    gathered on its ends, after which one of them covers it. The framework is rigid in the plane, for every
+    placement of its joints, only if the count reaches 2n - 3."""
+    pebbles = [2]*n
+    covered = [[] for _ in range(n)]
+
+    def gather(start, keep):
+        # Depth-first search along covered members for a joint with a free pebble, reversing the path to it
+        seen = {start, keep}
+        path = [start]
+        branches = [iter(covered[start])]
+        while branches:
+            for j in branches[-1]:
+                if j in seen:
+                    continue
+                seen.add(j)
+                if pebbles[j] > 0:
+                    pebbles[j] -= 1
+                    pebbles[start] += 1
+                    for i, k in zip(path, path[1:] + [j]):
+                        covered[i].remove(k)
+                        covered[k].append(i)
+                    return True
+                path.append(j)
+                branches.append(iter(covered[j]))
+                break
+            else:
+                branches.pop()
+                path.pop()
+        return False
+
+    count = 0
+    for a, b in con:
+        if a == b:
+            continue
+        while pebbles[a] + pebbles[b] < 4:
+            if not (pebbles[a] < 2 and gather(a, b)) and not (pebbles[b] < 2 and gather(b, a)):
+                break
+        if pebbles[a] + pebbles[b] == 4:
+            pebbles[a] -= 1
+            covered[a].append(b)
+            count += 1
+    return count
+
+
+def is_mechanism(n, con, supports):
+    """Tests whether a planar truss whose joints are free in x and y apart from the pinned supports can move
+    without stretching any member, from its members alone. The supports are tied together into one rigid body,
+    which has to hold every joint in place."""
+    con = np.asarray(con, dtype=int).reshape(-1, 2)
+    supports = [int(j) for j in supports]
+    if len(supports) < 2:
+        return True
+
+    # Python lists are much faster than array rows to walk one member at a time
+    members = [tuple(member) for member in con.tolist()]
+    if not connected(n, members, supports):
+        return True
+
+    # Every free joint needs two members, and the framework as many independent members as it has freedoms
+    degree = np.bincount(con.ravel(), minlength=n)
+    free = np.ones(n, dtype=bool)
+    free[supports] = False
+    if np.any(degree[free] < 2):
+        return True
+    ground = [(supports[0], supports[1])] + [(supports[k], j) for j in supports[2:] for k in (0, 1)]
+    if len(con) + len(ground) < 2*n - 3:
+        return True
+
+    return independent_members(n, ground + members) < 2*n - 3
@@ -0,0 +1,305 @@
+import numpy as np
+
+try:
+    import scipy.sparse as sps
+except ImportError:
+    sps = None
+
+# Number of joint pairs above which shared neighbors are found with sparse adjacency products rather than set
+# intersections
+sparse_pairs = 64
+
+
+class RuleSets(object):
+    """Places in a truss where the lower and higher-tier rules can be applied, kept up to date between rules. Edits
+    mark the joints whose neighborhood changed and the grid cells of members that were added, removed or moved. Each
+    kind of set is brought up to date separately when it is read, by rebuilding only the candidates owned by marked
+    joints and re-testing collisions only for candidates in changed cells.
+
+    Joinable sets are owned by the joint they delete, diagonal and pattern candidates by the member they are built on.
+    Every candidate that refers to a joint is owned by that joint or one of its neighbors, so marking a joint together
+    with its neighbors is enough to refresh everything that depends on it."""
+
+    kinds = ('deletable', 'joinable', 'diagonal', 'pattern')
+
+    def __init__(self, design):
+        self.dirty_joints = dict((kind, set(range(design.n))) for kind in self.kinds)
+        self.changed_cells = dict((kind, set()) for kind in self.kinds)
+
+        self.deletable = set()
+        self.weak = set()
+        self.joinable = {}
+        self.diagonals = {}
+        self.patterns = {}
+
+        # Whether each candidate is blocked by a crossing member, and the grid cells its new members pass through
+        self.blocked = {}
+        self.candidate_cells = {}
+        self.cells = {}
+
+    def copy(self):
+        rule_sets = RuleSets.__new__(RuleSets)
+        rule_sets.dirty_joints = dict((kind, set(joints)) for kind, joints in self.dirty_joints.items())
+        rule_sets.changed_cells = dict((kind, set(keys)) for kind, keys in self.changed_cells.items())
+        rule_sets.deletable = set(self.deletable)
+        rule_sets.weak = set(self.weak)
+        rule_sets.joinable = dict(self.joinable)
+        rule_sets.diagonals = dict(self.diagonals)
+        rule_sets.patterns = dict(self.patterns)
+        rule_sets.blocked = dict(self.blocked)
+        rule_sets.candidate_cells = dict(self.candidate_cells)
+        rule_sets.cells = dict((key, set(candidates)) for key, candidates in self.cells.items())
+        return rule_sets
+
+    def pending(self, kind):
+        return len(self.dirty_joints[kind]) > 0 or len(self.changed_cells[kind]) > 0
+
+    # Called by the truss edit methods
+
+    def touch_joints(self, design, joints):
+        touched = set(joints)
+        for joint in joints:
+            touched.update(design.neighbors(joint))
+        for kind in self.kinds:
+            self.dirty_joints[kind].update(touched)
+
+    def touch_cells(self, keys):
+        for kind in self.kinds:
+            self.changed_cells[kind].update(keys)
+
+    def drop_member(self, a, b):
+        # Candidates built on a member that is about to be removed or renumbered
+        pair = (min(a, b), max(a, b))
+        for candidate in self.diagonals.pop(pair, []):
+            self._forget(('diagonal',) + pair + candidate)
+        for candidate in self.patterns.pop(pair, []):
+            self._forget(('pattern',) + pair + (candidate[0],))
+
+    def drop_joint(self, joint):
+        self.deletable.discard(joint)
+        self.weak.discard(joint)
+        for candidate in self.joinable.pop(joint, []):
+            self._forget(('joinable', joint) + candidate)
+
+    # Bringing one kind of set up to date
+
+    def update(self, design, kind):
+        grid = design.segment_grid()
+        refreshed = set()
+
+        dirty_joints = self.dirty_joints[kind]
+        if kind == 'deletable':
+            for joint in dirty_joints:
+                self.deletable.discard(joint)
+                if joint < design.n and joint not in design.undeletable_joints:
+                    # Deletable joints leave all of their neighbors with at least two members
+                    if all(design.degree(other) >= 3 for other in design.neighbors(joint)):
+                        self.deletable.add(joint)
+        elif kind == 'joinable':
+            for joint in dirty_joints:
+                self.weak.discard(joint)
+                for candidate in self.joinable.pop(joint, []):
+                    self._forget(('joinable', joint) + candidate)
+            self._joinable_candidates(design, sorted(joint for joint in dirty_joints if joint < design.n), grid,
+                                      refreshed)
+        else:
+            pairs = set()
+            for joint in dirty_joints:
+                if joint < design.n:
+                    for other in design.neighbors(joint):
+                        pairs.add((min(joint, other), max(joint, other)))
+            pairs = sorted(pairs)
+            for pair in pairs:
+                if kind == 'diagonal':
+                    for candidate in self.diagonals.pop(pair, []):
+                        self._forget(('diagonal',) + pair + candidate)
+                else:
+                    for candidate in self.patterns.pop(pair, []):
+                        self._forget(('pattern',) + pair + (candidate[0],))
+            matches = common_neighbors(design, pairs)
+            if kind == 'diagonal':
+                for pair, match in zip(pairs, matches):
+                    self._diagonal_candidates(design, pair, match, grid, refreshed)
+            else:
+                self._pattern_candidates(design, pairs, matches, grid, refreshed)
+
+        # Collisions with members that were added, removed or moved since this kind was last brought up to date
+        touched = set()
+        for key in self.changed_cells[kind]:
+            touched.update(candidate for candidate in self.cells.get(key, ()) if candidate[0] == kind)
+        for candidate in touched - refreshed:
+            self.blocked[candidate] = self._is_blocked(design, candidate)
+
+        self.dirty_joints[kind] = set()
+        self.changed_cells[kind] = set()
+
+    def _joinable_candidates(self, design, joints, grid, refreshed):
+        # Pairs of neighbors that share at least two joints and could be joined by deleting their joint. Joining
+        # removes one member from each neighbor and gives one back to the two joints that are joined.
+        owners = []
+        pairs = []
+        for joint in joints:
+            if design.degree(joint) < 2:
+                self.weak.add(joint)
+            if joint in design.undeletable_joints:
+                continue
+            connected_joints = sorted(design.neighbors(joint))
+            weak = [k for k in connected_joints if design.degree(k) < 3]
+            if len(weak) > 2:
+                continue
+            for i in connected_joints:
+                for j in connected_joints:
+                    if j > i and j not in design.neighbors(i) and all(k == i or k == j for k in weak):
+                        owners.append(joint)
+                        pairs.append((i, j))
+
+        for joint, pair, match in zip(owners, pairs, common_neighbors(design, pairs)):
+            if len(match) >= 2:
+                self.joinable.setdefault(joint, []).append(pair)
+                self._register(design, ('joinable', joint) + pair, [(design.coord[pair[0]], design.coord[pair[1]])],
+                               grid, refreshed)
+
+    def _diagonal_candidates(self, design, pair, match, grid, refreshed):
+        # Diagonal positions between two joints the member's ends share, where no member exists yet
+        diagonals = []
+        for k in range(len(match)):
+            for l in range(k + 1, len(match)):
+                if design.member_index(match[k], match[l]) is None:
+                    diagonals.append((match[k], match[l]))
+                    self._register(design, ('diagonal',) + pair + (match[k], match[l]),
+                                   [(design.coord[match[k]], design.coord[match[l]])], grid, refreshed)
+        if len(diagonals) > 0:
+            self.diagonals[pair] = diagonals
+
+    def _pattern_candidates(self, design, pairs, matches, grid, refreshed):
+        # Mirror images of the triangles the members belong to, all reflected at once
+        ends = [design.con[design.member_index(pair[0], pair[1])] for pair in pairs]
+        triangles = [(joint_a, joint_b, joint_c)
+                     for (joint_a, joint_b), match in zip(ends, matches) for joint_c in match]
+        if len(triangles) == 0:
+            return
+        triangles = np.array(triangles)
+        reflected = reflect(design.coord[triangles[:, 0]], design.coord[triangles[:, 1]],
+                            design.coord[triangles[:, 2]])
+
+        t = 0
+        for pair, (joint_a, joint_b), match in zip(pairs, ends, matches):
+            patterns = []
+            for joint_c in match:
+                coord_d = reflected[t]
+                t += 1
+                patterns.append((joint_c, coord_d))
+                self._register(design, ('pattern',) + pair + (joint_c,),
+                               [(coord_d, design.coord[joint_a]), (coord_d, design.coord[joint_b])], grid, refreshed)
+            if len(patterns) > 0:
+                self.patterns[pair] = patterns
+
+    def _register(self, design, candidate, segments, grid, refreshed):
+        keys = []
+        for node_a, node_b in segments:
+            keys += grid.segment_cells(node_a, node_b)
+        self.candidate_cells[candidate] = keys
+        for key in keys:
+            self.cells.setdefault(key, set()).add(candidate)
+        self.blocked[candidate] = self._is_blocked(design, candidate)
+        refreshed.add(candidate)
+
+    def _forget(self, candidate):
+        del self.blocked[candidate]
+        for key in self.candidate_cells.pop(candidate):
+            candidates = self.cells.get(key)
+            if candidates is not None:
+                candidates.discard(candidate)
+                if len(candidates) == 0:
+                    del self.cells[key]
+
+    def _is_blocked(self, design, candidate):
+        if candidate[0] == 'joinable':
+            # Members of the joint being deleted are ignored, as they go with it
+            crossed = design.con[design.crossed_members(design.coord[candidate[2]], design.coord[candidate[3]])]
+            return bool(np.any(np.all(crossed != candidate[1], axis=1)))
+        elif candidate[0] == 'diagonal':
+            # The member being moved is ignored
+            crossed = design.crossed_members(design.coord[candidate[3]], design.coord[candidate[4]])
+            return bool(np.any(crossed != design.member_index(candidate[1], candidate[2])))
+        else:
+            joint_a, joint_b = design.con[design.member_index(candidate[1], candidate[2])]
+            coord_d = reflect(design.coord[joint_a], design.coord[joint_b], design.coord[candidate[3]])
+            return len(design.crossed_members(coord_d, design.coord[candidate[1]])) > 0 or \
+                len(design.crossed_members(coord_d, design.coord[candidate[2]])) > 0
+
+    # Reading the sets, in the order of a full scan
+
+    def read(self, design, kind):
+        if kind == 'deletable':
+            return sorted(self.deletable)
+        elif kind == 'joinable':
+            return self._joinable_sets(design)
+        elif kind == 'diagonal':
+            return self._re_diagonable_members(design)
+        else:
+            return self._valid_patterns(design)
+
+    def _joinable_sets(self, design):
+        joinable_sets = []
+        for joint in sorted(self.joinable):
+            connected_joints = design.neighbors(joint)
+            for i, j in self.joinable[joint]:
+                if self.blocked[('joinable', joint, i, j)]:
+                    continue
+                # Joining must not leave a joint elsewhere in the design with fewer than two members
+                if any(k not in connected_joints and k != i and k != j for k in self.weak):
+                    continue
+                joinable_sets.append([joint, i, j])
+        return joinable_sets
+
+    def _re_diagonable_members(self, design):
+        found = []
+        for pair, diagonals in self.diagonals.items():
+            member_index = design.member_index(pair[0], pair[1])
+            for diagonal in diagonals:
+                if not self.blocked[('diagonal',) + pair + diagonal]:
+                    found.append((member_index, diagonal))
+        found.sort()
+        return [[member_index, design.con[member_index], diagonal] for member_index, diagonal in found]
+
+    def _valid_patterns(self, design):
+        found = []
+        for pair, patterns in self.patterns.items():
+            member_index = design.member_index(pair[0], pair[1])
+            for joint_c, coord_d in patterns:
+                if not self.blocked[('pattern',) + pair + (joint_c,)]:
+                    found.append((member_index, joint_c, coord_d))
+        found.sort(key=lambda pattern: pattern[:2])
+        return [[list(coord_d), design.con[member_index][0], design.con[member_index][1]]
+                for member_index, joint_c, coord_d in found]
+
+
+def common_neighbors(design, pairs):
+    """Sorted joints connected to both joints of each pair. For many pairs these are the non-zero terms of the
+    adjacency product A*A at the pairs, found for all pairs at once by multiplying the two rows of A elementwise."""
+    if sps is None or len(pairs) < sparse_pairs:
+        return [sorted(design.neighbors(i) & design.neighbors(j)) for i, j in pairs]
+
+    ends = design.con
+    adjacency = sps.csr_matrix((np.ones(2*len(ends), dtype=np.int8),
+                                (np.concatenate([ends[:, 0], ends[:, 1]]), np.concatenate([ends[:, 1], ends[:, 0]]))),
+                               shape=(design.n, design.n))
+    pairs = np.array(pairs, dtype=int).reshape(-1, 2)
+    common = adjacency[pairs[:, 0]].multiply(adjacency[pairs[:, 1]]).tocsr()
+    common.sort_indices()
+    joints = common.indices.tolist()
+    bounds = common.indptr.tolist()
+    return [joints[bounds[k]:bounds[k + 1]] for k in range(len(pairs))]
+
+
+def reflect(coord_a, coord_b, coord_c):
+    # Coordinates of points c reflected in the lines through a and b. The points are arrays of shape (..., 2) or
+    # (..., 3) that broadcast against each other, and the reflections have z = 0. Points are reflected through a
+    # when a and b coincide.
+    a, b, c = [np.asarray(point, dtype=float)[..., :2] for point in (coord_a, coord_b, coord_c)]
+    u = b - a
+    length = np.sum(u*u, axis=-1)
+    t = np.sum((c - a)*u, axis=-1)/np.where(length > 0, length, 1.0)
+    d = 2*(a + t[..., np.newaxis]*u) - c
+    return np.concatenate([d, np.zeros(d.shape[:-1] + (1,))], axis=-1)
@@ -0,0 +1,112 @@
+import math
+import numpy as np
+
+import truss.geometry
+
+
+class SegmentGrid(object):
+    """Uniform grid over the members of a truss. Each member is listed in the cells its segment passes through, so
+    the members a segment could cross are found by looking in the cells that segment passes through."""
+
+    def __init__(self, coord, con, cell_size=None):
+        if cell_size is None:
+            lengths = [np.linalg.norm(np.subtract(coord[b], coord[a])[:2]) for a, b in con]
+            cell_size = np.mean(lengths) if len(lengths) > 0 else 1.0
+        self.cell_size = cell_size if cell_size > 0 else 1.0
+
+        self.cells = {}
+        self.member_cells = []
+        for a, b in con:
+            self.add(coord[a], coord[b])
+
+    def copy(self):
+        grid = SegmentGrid.__new__(SegmentGrid)
+        grid.cell_size = self.cell_size
+        grid.cells = dict((key, set(members)) for key, members in self.cells.items())
+        grid.member_cells = list(self.member_cells)
+        return grid
+
+    def segment_cells(self, a, b):
+        # Cells passed through by segment a-b, found column by column. The segment is padded by the intersection
+        # tolerance so that crossings on a cell boundary are seen from both sides.
+        pad = truss.geometry.rounding_error
+        x0, y0, x1, y1 = a[0], a[1], b[0], b[1]
+        if x1 < x0:
+            x0, y0, x1, y1 = x1, y1, x0, y0
+        h = self.cell_size
+
+        keys = []
+        for ix in range(int(math.floor((x0 - pad)/h)), int(math.floor((x1 + pad)/h)) + 1):
+            if x1 > x0:
+                xa = min(max(ix*h, x0), x1)
+                xb = min(max((ix + 1)*h, x0), x1)
+                ya = y0 + (y1 - y0)*(xa - x0)/(x1 - x0)
+                yb = y0 + (y1 - y0)*(xb - x0)/(x1 - x0)
+            else:
+                ya, yb = y0, y1
+            for iy in range(int(math.floor((min(ya, yb) - pad)/h)), int(math.floor((max(ya, yb) + pad)/h)) + 1):
+                keys.append((ix, iy))
+        return keys
+
+    # The edit methods return the cells whose contents changed
+
+    def add(self, a, b):
+        # Members are added at the end, as in the truss member list
+        i = len(self.member_cells)
+        keys = self.segment_cells(a, b)
+        for key in keys:
+            self.cells.setdefault(key, set()).add(i)
+        self.member_cells.append(keys)
+        return keys
+
+    def remove(self, i):
+        # The last member takes the place of the removed one, as in the truss member list
+        keys = self.member_cells[i]
+        self._discard(i)
+        last = len(self.member_cells) - 1
+        if i != last:
+            for key in self.member_cells[last]:
+                self.cells[key].remove(last)
+                self.cells[key].add(i)
+            self.member_cells[i] = self.member_cells[last]
+        self.member_cells.pop()
+        return keys
+
+    def move(self, i, a, b):
+        old_keys = self.member_cells[i]
+        self._discard(i)
+        keys = self.segment_cells(a, b)
+        for key in keys:
+            self.cells.setdefault(key, set()).add(i)
+        self.member_cells[i] = keys
+        return old_keys + keys
+
+    def _discard(self, i):
+        for key in self.member_cells[i]:
+            members = self.cells[key]
+            members.remove(i)
+            if len(members) == 0:
+                del self.cells[key]
+
+    def query(self, a, b):
+        # Sorted indices of the members listed in any cell that segment a-b passes through
+        found = set()
+        for key in self.segment_cells(a, b):
+            members = self.cells.get(key)
+            if members is not None:
+                found.update(members)
+        return np.array(sorted(found), dtype=int)
+
+    def pairs(self):
+        # Index pairs (i, j), i < j, of members that are listed in a common cell
+        m = len(self.member_cells)
+        codes = []
+        for members in self.cells.values():
+            if len(members) > 1:
+                members = np.array(sorted(members))
+                i, j = np.triu_indices(len(members), 1)
+                codes.append(members[i]*m + members[j])
+        if len(codes) == 0:
+            return np.zeros([0, 2], dtype=int)
+        codes = np.unique(np.concatenate(codes))
+        return np.column_stack([codes//m, codes % m])
@@ -6,12 +6,32 @@ import copy
 import numpy as np
 import math
 
+import truss.evaluation_cache
+import truss.geometry
+import truss.reanalysis
+import truss.rigidity
+import truss.rule_sets
+import truss.segment_grid
+
 from matplotlib.tri import Triangulation
 
+try:
+    import scipy.linalg as sla
+    import scipy.sparse as sps
+    import scipy.sparse.linalg as spla
+    from scipy.linalg import lapack
+    from scipy.sparse.csgraph import reverse_cuthill_mckee
+except ImportError:
+    sla = None
+    sps = None
+    spla = None
+    lapack = None
+    reverse_cuthill_mckee = None
+
 
 class Truss(AbstractBaseSolution):
     num_lowtier_rules = 7
-    num_hightier_rules = 5
+    num_hightier_rules = 6
 
     # Yield strength of steel
     Fy = 344 * pow(10, 6)
@@ -20,29 +40,86 @@ class Truss(AbstractBaseSolution):
     E = 210 * pow(10, 9)
 
     # Outer diameters of the optional sizes, in meters
-    OUTER_DIAM = [(x + 10.0) / 1000 for x in range(100)]
+    OUTER_DIAM = (np.arange(100) + 10.0) / 1000
 
     # Thickness of the wall sections of optional sizes, in meters
-    THICK = [d / 15 for d in OUTER_DIAM]
+    THICK = OUTER_DIAM / 15
 
-    # Cross sectional area in m^2
-    AREA_SEC = [math.pi * pow(d / 2, 2) - math.pi * pow(d / 2 - d / 15, 2) for d in OUTER_DIAM]
+    # Cross sectional area in m^2 (float_power rounds like the builtin pow)
+    AREA_SEC = math.pi * np.float_power(OUTER_DIAM / 2, 2) - math.pi * np.float_power(OUTER_DIAM / 2 - OUTER_DIAM / 15, 2)
 
     # Moment of inertia, in m^4
-    I_SEC = [math.pi * (pow(d, 4) - pow((d - 2 * d / 15), 4)) / 64 for d in OUTER_DIAM]
+    I_SEC = math.pi * (np.float_power(OUTER_DIAM, 4) - np.float_power((OUTER_DIAM - 2 * OUTER_DIAM / 15), 4)) / 64
 
     # Weight per length, kg/ft
-    WEIGHT = [a * 7870 for a in AREA_SEC]
+    WEIGHT = AREA_SEC * 7870
+
+    # Linear solver used in the force analysis: 'auto', 'dense', 'cholesky' or 'sparse'. Without SciPy every
+    # choice falls back to 'dense'.
+    solver = 'auto'
+
+    # Number of joints above which 'auto' switches from Cholesky to the sparse solver (see
+    # sparse_crossover_benchmark.py)
+    sparse_threshold = 140
+
+    # Renumber joints with reverse Cuthill-McKee before a sparse factorization
+    renumber_joints = True
+
+    # Analyse designs that lie in the z = 0 plane with two degrees of freedom per joint instead of three
+    planar_analysis = True
+
+    # Reuse the last factorization through Sherman-Morrison-Woodbury updates for designs that differ from it by
+    # a stiffness change of at most max_update_rank (one for a resized member, two for a moved one)
+    low_rank_updates = True
+    max_update_rank = 8
 
+    # Number of evaluated designs whose results are kept for candidates that repeat them, and the spacing joint
+    # coordinates are rounded to when designs are compared (None compares them exactly)
+    evaluation_cache_size = 1024
+    evaluation_cache_quantum = None
+
+    # Penalize designs that are mechanisms by their members alone, found by union-find and the planar pebble game,
+    # before any stiffness matrix is assembled
+    rigidity_check = True
+
+    # Let LT6 and LT7 follow the sensitivities of the quality agents maximize, mass plus the squared shortfall of
+    # the lowest factor of safety times fos_penalty, instead of moving joints and resizing members at random
+    gradient_rules = False
+    fos_penalty = 100
+
+    # Joints and members live in arrays with spare capacity that grow by doubling, and the public coord, con and
+    # sizes attributes are views of the first n joints and m members. Connectivity is indexed by a neighbor set
+    # per joint and a map from joint pairs to member indices. Copies share all of this until one side edits it,
+    # so edits have to go through the methods below rather than the views.
     def __init__(self):
         # Save number of joints
-        self.n = 5
+        self.n = 0
 
         self.em = np.zeros(100)
         self.ej = np.zeros(100)
 
+        # Storage starts empty and is filled through add_joint and add_member
+        self.m = 0
+        self._coord = np.zeros([8, 3])
+        self._con = np.zeros([16, 2], dtype=int)
+        self._sizes = np.zeros(16)
+        self._neighbors = []
+        self._member_index = {}
+        self._grid = None
+        self._rule_sets = None
+        self._rule_lists = {}
+        self._shared = False
+
+        # Supports, loads and degree of freedom indices of the analysis, kept until a joint or member is added or
+        # removed (see _topology_data)
+        self._topology = None
+
+        # Members added or moved since the design was last found valid, or None before it has been checked
+        self._dirty = None
+
         # Create first set of nodal coordinates
-        self.coord = np.array([[0, 0, 0], [5, 0, 0], [2.5, 0, 0], [1.25, 3, 0], [3.75, 3, 0]])
+        for xy in [[0, 0, 0], [5, 0, 0], [2.5, 0, 0], [1.25, 3, 0], [3.75, 3, 0]]:
+            self.add_joint(xy)
 
         self.fixed_joints = [0, 1]
         self.force_joints = [2]
@@ -52,22 +129,15 @@ class Truss(AbstractBaseSolution):
         for joint in self.force_joints:
             self.undeletable_joints.append(joint)
 
-        # Create connections for first set of nodes
-        self.con = np.array([[0, 2], [1, 2], [0, 3], [1, 4], [2, 3], [2, 4], [3, 4]])
-
-        self.dof = np.zeros(len(self.coord))
+        # Load cases the design is checked against, each mapping loaded joints to their load in N. Loaded joints
+        # belong in force_joints, so that rules never delete them.
+        self.load_cases = [{2: (0.0, -250000.0, 0.0)}]
 
-        # Store final number of members
-        self.m = len(self.con)
+        # Create connections for first set of nodes, establishing the connectivity matrix and member sizes
+        for member in [[0, 2], [1, 2], [0, 3], [1, 4], [2, 3], [2, 4], [3, 4]]:
+            self.add_member(member[0], member[1])
 
-        # Initialize truss sizes
-        self.sizes = np.ones(len(self.con)) * 50
-
-        # Establish the connectivity matrix
-        self.con_mat = np.zeros([self.n, self.n])
-        for member in self.con:
-            self.con_mat[member[0], member[1]] = 1.0
-            self.con_mat[member[1], member[0]] = 1.0
+        self.dof = np.zeros(len(self.coord))
 
         # Target factor of safety
         self.target_fos = 1.0
@@ -75,96 +145,227 @@ class Truss(AbstractBaseSolution):
         # Evaluate the truss
         self.force = [0.0]
         self.fos = np.array([0.0])
+        self.case_fos = np.array([[0.0]])
         self.mass = 0.0
 
         # List of applied rules
         self.applied_rules = []
         self.stable_system = True
 
+        # Factorization of the last fully analysed design, shared with every copy of this design
+        self.reanalysis = truss.reanalysis.Reanalysis(self.max_update_rank)
+
+        # Results of recently evaluated designs, also shared with every copy
+        self.evaluation_cache = truss.evaluation_cache.EvaluationCache(self.evaluation_cache_size,
+                                                                       self.evaluation_cache_quantum)
+
+    @property
+    def coord(self):
+        return self._coord[:self.n]
+
+    @property
+    def con(self):
+        return self._con[:self.m]
+
+    @property
+    def sizes(self):
+        return self._sizes[:self.m]
+
+    @property
+    def con_mat(self):
+        # Dense connectivity matrix, built on demand from the member list
+        con_mat = np.zeros([self.n, self.n])
+        con_mat[self.con[:, 0], self.con[:, 1]] = 1.0
+        con_mat[self.con[:, 1], self.con[:, 0]] = 1.0
+        return con_mat
+
+    def neighbors(self, j):
+        return self._neighbors[j]
+
+    def degree(self, j):
+        return len(self._neighbors[j])
+
+    def member_index(self, a, b):
+        # Index of the member between joints a and b, or None if they are not connected
+        return self._member_index.get((min(a, b), max(a, b)))
+
+    def segment_grid(self):
+        # Spatial index of the members, built on first use and then kept up to date by the edit methods
+        if self._grid is None:
+            self._grid = truss.segment_grid.SegmentGrid(self.coord, self.con)
+        return self._grid
+
+    def crossed_members(self, node_a, node_b):
+        # Indices of the members that segment node_a-node_b intersects
+        candidates = self.segment_grid().query(node_a, node_b)
+        ends = self.con[candidates]
+        hit = truss.geometry.segments_intersect(node_a, node_b, self.coord[ends[:, 0]], self.coord[ends[:, 1]])
+        return candidates[hit]
+
+    def visible_joints(self, point):
+        # Joints that a new member from point could reach without crossing an existing member
+        ends = self.con
+        visible = truss.geometry.visible_points(point, self.coord, self.coord[ends[:, 0]], self.coord[ends[:, 1]])
+        return np.nonzero(visible)[0].tolist()
+
+    def joint_travel(self, j, dxy):
+        # Fraction of displacement dxy that joint j can be moved by, at most one, before any of its members
+        # touches a member it does not share a joint with
+        ends = np.array(sorted(self._neighbors[j]), dtype=int)
+        if len(ends) == 0:
+            return 1.0
+        con = self.con
+        excluded = np.any(con == j, axis=1)[np.newaxis, :] | \
+            np.any(con[np.newaxis, :, :] == ends[:, np.newaxis, np.newaxis], axis=2)
+        return truss.geometry.free_travel(self.coord[j], dxy, self.coord[ends], self.coord[con[:, 0]],
+                                          self.coord[con[:, 1]], excluded)
+
     # Basic functions needed to implement rules below
 
+    def _own_storage(self):
+        # Take a private copy of storage shared with a parent or child design before the first edit
+        if self._shared:
+            self._coord = self._coord.copy()
+            self._con = self._con.copy()
+            self._sizes = self._sizes.copy()
+            self._neighbors = [set(joints) for joints in self._neighbors]
+            self._member_index = dict(self._member_index)
+            if self._grid is not None:
+                self._grid = self._grid.copy()
+            if self._rule_sets is not None:
+                self._rule_sets = self._rule_sets.copy()
+            self._shared = False
+
+    def _reserve_joints(self, count):
+        capacity = len(self._coord)
+        if count <= capacity:
+            return
+        capacity = max(count, 2*capacity)
+
+        coord = np.zeros([capacity, 3])
+        coord[:self.n] = self._coord[:self.n]
+        self._coord = coord
+
+    def _reserve_members(self, count):
+        capacity = len(self._con)
+        if count <= capacity:
+            return
+        capacity = max(count, 2*capacity)
+
+        con = np.zeros([capacity, 2], dtype=int)
+        con[:self.m] = self._con[:self.m]
+        self._con = con
+
+        sizes = np.zeros(capacity)
+        sizes[:self.m] = self._sizes[:self.m]
+        self._sizes = sizes
+
     def add_joint(self, xy):
+        self._own_storage()
+        self._topology = None
+        self._reserve_joints(self.n + 1)
+        self._coord[self.n] = xy
+        self._neighbors.append(set())
+        if self._rule_sets is not None:
+            self._rule_sets.touch_joints(self, [self.n])
+
         # Increase number of joints
         self.n += 1
 
-        temp = np.zeros([self.n, self.n])
-        for i in range(self.n - 1):
-            for j in range(self.n - 1):
-                temp[i, j] = self.con_mat[i, j]
-
-        self.con_mat = temp
-
-        #         self.con_mat.resize(self.n, self.n)
-        self.coord = np.vstack([self.coord, xy])
-        b = [max(c) + 0.001 * min(c) for c in self.con]
-        # if len(b) > 0:
-        #     ratio = float(len(b)) / float(len(np.unique(b)))
-        #     if ratio > 1.0:
-        #         print("Add Joint:" + str(ratio))
-
     def add_member(self, a, b):
-        self.con = np.vstack([self.con, np.array([a, b])])
-        self.con_mat[a, b] = 1.0
-        self.con_mat[b, a] = 1.0
-        self.sizes = np.hstack([self.sizes, np.array(50.0)])
+        self._own_storage()
+        self._topology = None
+        self._reserve_members(self.m + 1)
+        self._con[self.m] = [a, b]
+        self._sizes[self.m] = 50.0
+        self._neighbors[a].add(b)
+        self._neighbors[b].add(a)
+        self._member_index[(min(a, b), max(a, b))] = self.m
+        if self._grid is not None:
+            keys = self._grid.add(self._coord[a], self._coord[b])
+            if self._rule_sets is not None:
+                self._rule_sets.touch_joints(self, [a, b])
+                self._rule_sets.touch_cells(keys)
+        if self._dirty is not None:
+            self._dirty.add(self.m)
         self.m += 1
-        d = [max(c) + 0.001 * min(c) for c in self.con]
-        # if len(d) > 0:
-        #     ratio = float(len(d)) / float(len(np.unique(d)))
-        #     if ratio > 1.0:
-        #         print("Add Member 2:" + str(ratio))
-        #         print(len(self.con.T) / 2, sum(self.con_mat) / 2)
 
     def remove_joint(self, j):
-        # Remove from coordinate list
-        self.coord = np.delete(self.coord, j, 0)
-
-        # Remove row and column from conn_mat
-        self.con_mat = np.delete(self.con_mat, j, 0)
-        self.con_mat = np.delete(self.con_mat, j, 1)
-
-        # Remove connected members
-        row, _ = np.where(self.con == j)
-        self.con = np.delete(self.con, row, 0)
-        self.sizes = np.delete(self.sizes, row)
-        self.m -= len(row)
-
-        # Decrement connections appropriately
-        for i in range(self.m):
-            if self.con[i, 0] > j:
-                self.con[i, 0] -= 1
-            if self.con[i, 1] > j:
-                self.con[i, 1] -= 1
+        self._own_storage()
+        self._topology = None
+
+        # Remove connected members, highest index first so swap-removal never moves one that is still pending
+        for member in sorted([self.member_index(j, k) for k in self._neighbors[j]], reverse=True):
+            self.remove_member(member)
+
+        # The last joint takes the place of the removed one, and its members are renumbered
+        last = self.n - 1
+        if self._rule_sets is not None:
+            self._rule_sets.touch_joints(self, [j, last])
+            self._rule_sets.drop_joint(last)
+            for k in self._neighbors[last]:
+                self._rule_sets.drop_member(k, last)
+        if j != last:
+            self._coord[j] = self._coord[last]
+            for k in self._neighbors[last]:
+                member = self._member_index.pop((min(k, last), max(k, last)))
+                self._con[member][self._con[member] == last] = j
+                self._member_index[(min(k, j), max(k, j))] = member
+                self._neighbors[k].remove(last)
+                self._neighbors[k].add(j)
+            self._neighbors[j] = self._neighbors[last]
+            if self._rule_sets is not None:
+                self._rule_sets.touch_joints(self, [j])
+        self._neighbors.pop()
 
         # Decrement number of joints
         self.n -= 1
-        b = [max(c) + 0.001 * min(c) for c in self.con]
-        # if len(b) > 0:
-        #     ratio = float(len(b)) / float(len(np.unique(b)))
-        #     if ratio > 1.0:
-        #         print("Del Joint:" + str(ratio))
 
     def remove_member(self, j):
-        self.con_mat[self.con[j, 1], self.con[j, 0]] = 0.0
-        self.con_mat[self.con[j, 0], self.con[j, 1]] = 0.0
-        self.con = np.delete(self.con, j, 0)
-        self.sizes = np.delete(self.sizes, j)
+        self._own_storage()
+        self._topology = None
+        a, b = self._con[j]
+        if self._rule_sets is not None:
+            self._rule_sets.touch_joints(self, [a, b])
+            self._rule_sets.drop_member(a, b)
+        self._neighbors[a].discard(b)
+        self._neighbors[b].discard(a)
+        self._member_index.pop((min(a, b), max(a, b)), None)
+        if self._grid is not None:
+            keys = self._grid.remove(j)
+            if self._rule_sets is not None:
+                self._rule_sets.touch_cells(keys)
+        if self._dirty is not None:
+            self._dirty.discard(j)
+
+        # The last member takes the place of the removed one
+        last = self.m - 1
+        if j != last:
+            self._con[j] = self._con[last]
+            self._sizes[j] = self._sizes[last]
+            a, b = self._con[j]
+            self._member_index[(min(a, b), max(a, b))] = j
+            if self._dirty is not None and last in self._dirty:
+                self._dirty.remove(last)
+                self._dirty.add(j)
         self.m -= 1
-        b = [max(c) + 0.001 * min(c) for c in self.con]
-        # if len(b) > 0:
-        #     ratio = float(len(b)) / float(len(np.unique(b)))
-        #     if ratio > 1.0:
-        #         print("Del Member:" + str(ratio))
 
     def move_joint(self, j, dxy):
+        self._own_storage()
         self.coord[j, :] += dxy
-        b = [max(c) + 0.001 * min(c) for c in self.con]
-        # if len(b) > 0:
-        #     ratio = float(len(b)) / float(len(np.unique(b)))
-        #     if ratio > 1.0:
-        #         print("Move Joint:" + str(ratio))
+        if self._rule_sets is not None:
+            self._rule_sets.touch_joints(self, [j])
+        for k in self._neighbors[j]:
+            member = self.member_index(j, k)
+            if self._grid is not None:
+                keys = self._grid.move(member, self._coord[j], self._coord[k])
+                if self._rule_sets is not None:
+                    self._rule_sets.touch_cells(keys)
+            if self._dirty is not None:
+                self._dirty.add(member)
 
     def change_member_size(self, j, dsize):
+        self._own_storage()
         self.sizes[j] += dsize
         if self.sizes[j] > 99.0:
             self.sizes[j] = 99.0
@@ -201,124 +402,541 @@ class Truss(AbstractBaseSolution):
 
     # Functions needed for evaluation below
     def evaluate(self):
-        self.mass_eval()
-        self.fos_eval()
-        # self.quality_eval()
+        # Designs that were evaluated before take their results from the cache, which keeps the per-member ones in
+        # its own member order
+        order = self.evaluation_cache.member_order(self)
+        key = self.evaluation_cache.key(self, order)
+        cached = self.evaluation_cache.get(key)
+        if cached is not None:
+            self.mass, fos, case_fos, force, self.stable = cached
+            inverse = np.argsort(order)
+            self.fos, self.case_fos, self.force = fos[inverse], case_fos[:, inverse], force[inverse]
+        else:
+            # Member geometry is shared by the mass and the force analysis
+            geometry = self._member_geometry()
+            self.mass_eval(geometry)
+            self.fos_eval(geometry)
+            # self.quality_eval()
+            self.evaluation_cache.put(key, (self.mass, self.fos[order], self.case_fos[:, order], self.force[order],
+                                            self.stable))
 
         return [self.mass, self.fos, self.target_fos]
 
-    def mass_eval(self):
+    def _member_geometry(self):
+        # Member vectors (3 x m) and lengths. Batched dot products round the same way np.linalg.norm does on a
+        # single member.
+        C = (self.coord[self.con[:, 1]] - self.coord[self.con[:, 0]]).T
+        L = np.sqrt(np.matmul(C.T[:, None, :], C.T[:, :, None]).ravel())
+        return C, L
+
+    def mass_eval(self, geometry=None):
         """This function calculates the mass of the truss"""
-        # Calculate lengths
-        L = np.zeros(self.m)
-        for i in range(self.m):
-            L[i] = np.linalg.norm(self.coord[self.con[i, 0], :] - self.coord[self.con[i, 1], :])
+        if geometry is None:
+            geometry = self._member_geometry()
+        _, L = geometry
 
         # Calculate total mass
-        self.mass = 0
-        for i in range(self.m):
-            self.mass += L[i]*self.WEIGHT[int(self.sizes[i])]
+        self.mass = np.dot(L, self.WEIGHT[self.sizes.astype(int)])
 
-    def fos_eval(self):
+    def fos_eval(self, geometry=None):
         support = np.array([[1, 1, 1], [1, 1, 1]]).T
-        self._single_fos_eval(support)
-
-    def _single_fos_eval(self, support):
-        D = {}
+        self._single_fos_eval(support, geometry)
 
-        D["Re"] = support
-        for _ in range(self.n - 2):
-            D["Re"] = np.column_stack([D["Re"], [0, 0, 1]])
+    def evaluate_sizes(self, size_sets):
+        """Evaluates many member size assignments for the current joints and members at once, without changing
+        the truss. size_sets is a K x m array of catalog indices; returns the K masses and the K x m factors of
+        safety in the governing load case, matching what evaluate() would give for each row."""
+        size_sets = np.atleast_2d(np.asarray(size_sets)).astype(int)
+        support = np.array([[1, 1, 1], [1, 1, 1]]).T
+        D = self._analysis_data(support)
+        D["A"] = np.ones(self.m)
 
-        # Add the appropriate loads
-        D["Load"] = np.zeros([3, self.n])
-        # D["Load"][1, 2] = -200000.0
-        D["Load"][1, 2] = -250000.0
+        # Geometry is shared by every candidate, only the member stiffnesses change
+        H, T, Le, G_unit = self._member_stiffness(D)
+        G = self.AREA_SEC[size_sets]*G_unit
 
-        # Add the area information from truss structure
-        D["A"] = []
-        for member_size in self.sizes:
-            D["A"].append(self.AREA_SEC[int(member_size)])
-        D["Coord"] = self.coord.T
-        D["Con"] = self.con.T
-        D["E"] = self.E * np.ones(self.m)
+        ff = D["ff"]
+        Loadff = D["Loadff"]
+        SS = self._assemble_stiffness(H, T, G, self.n, dof=D["Dof"])
+        SSff = SS[:, ff][:, :, ff]
 
-        # Do force analysis
+        # Stacked solve, falling back to one candidate at a time if any of them is singular
+        singular = np.zeros(len(size_sets), dtype=bool)
         try:
-            self.force, U, R = self._force_eval(D)
-            self.stable = True
+            Uff = np.linalg.solve(SSff, np.tile(Loadff, (len(size_sets), 1, 1)))
+        except np.linalg.LinAlgError:
+            Uff = np.zeros([len(size_sets), len(ff), len(self.load_cases)])
+            for k in range(len(size_sets)):
+                try:
+                    Uff[k] = np.linalg.solve(SSff[k], Loadff)
+                except np.linalg.LinAlgError:
+                    singular[k] = True
+        ill_conditioned = np.zeros(len(size_sets), dtype=bool)
+        ill_conditioned[~singular] = np.linalg.cond(SSff[~singular]) > pow(10, 10)
+
+        # Displacements and member forces per candidate and load case
+        d = len(D["Re"])
+        Ufull = np.zeros([len(size_sets), len(self.load_cases), d*self.n])
+        Ufull[:, :, ff] = Uff.transpose(0, 2, 1)
+        dU = Ufull[:, :, d*H[1][:, None] + np.arange(d)] - Ufull[:, :, d*H[0][:, None] + np.arange(d)]
+        force = G[:, None, :]*np.einsum('kcmd,dm->kcm', dU, T)
+        force[ill_conditioned] *= pow(10, 10)
+        force[singular] = pow(10, 16)
+
+        mass = np.dot(self.WEIGHT[size_sets], Le)
+        fos = np.min(self._member_fos(force, size_sets[:, None, :], Le), axis=1)
+
+        return mass, fos
+
+    def sensitivities(self):
+        """Analyses the design like evaluate() and returns the derivatives of its mass and of its lowest factor of
+        safety with respect to the member sizes and the joint coordinates: d(mass)/d(size), d(fos)/d(size) as
+        arrays of length m and d(mass)/d(coord), d(fos)/d(coord) as n x 3 arrays. Sizes are treated as continuous
+        catalog indices. The factor of safety is differentiated through an adjoint solve with the factorization
+        used for the analysis, and its derivatives are zero for designs that are penalized as mechanisms."""
+        support = np.array([[1, 1, 1], [1, 1, 1]]).T
+        geometry = self._member_geometry()
+        self.mass_eval(geometry)
+        D = self._analysis_data(support, geometry)
+        d = len(D["Re"])
+        ff = D["ff"]
+        H, T, Le, G = self._member_stiffness(D)
+        sizes = self.sizes.astype(int)
+
+        # Mass only depends on the member lengths and the catalog weights, which grow with the diameter squared
+        dmass_dsize = Le*self.WEIGHT[sizes]*2/(self.OUTER_DIAM[sizes]*1000)
+        dmass_dcoord = np.zeros([self.n, 3])
+        for end, sign in [(1, 1.0), (0, -1.0)]:
+            for axis in range(d):
+                dmass_dcoord[:, axis] += sign*np.bincount(H[end], weights=self.WEIGHT[sizes]*T[axis],
+                                                          minlength=self.n)
+        dfos_dsize = np.zeros(self.m)
+        dfos_dcoord = np.zeros([self.n, 3])
+
+        # One factorization serves the analysis and the adjoint solve
+        try:
+            if self._is_mechanism():
+                raise np.linalg.LinAlgError('Mechanism')
+            solver = self._select_solver(self.n)
+            if solver == 'sparse':
+                SSff = self._assemble_stiffness(H, T, G, self.n, sparse=True, dof=D["Dof"])[ff][:, ff].tocsc()
+                factor_solve, rcond = self._sparse_factor(SSff, ff, D["Con"], self.n, d)
+            elif solver == 'cholesky':
+                SSff = self._assemble_stiffness(H, T, G, self.n, dof=D["Dof"])[np.ix_(ff, ff)]
+                factor_solve, rcond = self._cholesky_factor(SSff)
+            else:
+                SSff = self._assemble_stiffness(H, T, G, self.n, dof=D["Dof"])[np.ix_(ff, ff)]
+                factor_solve, rcond = lambda b: np.linalg.solve(SSff, b), 1.0/np.linalg.cond(SSff)
+            Uff = factor_solve(D["Loadff"])
         except np.linalg.LinAlgError:
-            self.force = np.ones(self.m) * pow(10, 16)
+            self.force = np.ones(self.m)*pow(10, 16)
+            self.fos = self._member_fos(self.force, self.sizes, Le)
+            self.case_fos = self.fos[None, :]
             self.stable = False
+            return dmass_dsize, dfos_dsize, dmass_dcoord, dfos_dcoord
+
+        U = np.zeros([len(D["Load"]), d*self.n])
+        U[:, ff] = Uff.T
+        dU = U.reshape([len(D["Load"]), self.n, d])[:, H[1]] - U.reshape([len(D["Load"]), self.n, d])[:, H[0]]
+        elongation = np.einsum('kmd,dm->km', dU, T)
+        force = G*elongation
+        self.stable = rcond >= pow(10, -10)
+        if not self.stable:
+            force *= pow(10, 10)
+        self.case_fos = self._member_fos(force, self.sizes, Le)
+        governing = np.argmin(self.case_fos, axis=0)
+        self.fos = self.case_fos[governing, np.arange(self.m)]
+        self.force = force[governing, np.arange(self.m)]
+
+        # The lowest factor of safety, of member g in load case k
+        k, g = np.unravel_index(np.argmin(self.case_fos), self.case_fos.shape)
+        fos = self.case_fos[k, g]
+        if not self.stable or not 0 < fos < pow(10, 10):
+            return dmass_dsize, dfos_dsize, dmass_dcoord, dfos_dcoord
+        F = force[k, g]
+        buckling = F < 0 and math.pi*math.pi*self.E*self.I_SEC[sizes[g] - 1]/(Le[g]*Le[g]) < \
+            self.AREA_SEC[sizes[g]]*self.Fy
+
+        # Adjoint of the force in member g: K*lam = dF_g/du
+        dF_du = np.zeros(d*self.n)
+        dF_du[d*H[1][g] + np.arange(d)] += G[g]*T[:, g]
+        dF_du[d*H[0][g] + np.arange(d)] -= G[g]*T[:, g]
+        lam = np.zeros(d*self.n)
+        lam[ff] = factor_solve(dF_du[ff])
+        dLam = lam.reshape([self.n, d])[H[1]] - lam.reshape([self.n, d])[H[0]]
+        stretch = np.einsum('md,dm->m', dLam, T)
+
+        # dF_g = dF_g/dp at fixed displacements - lam'*dK/dp*u, for the member areas and their end coordinates
+        dA_dsize = self.AREA_SEC[sizes]*2/(self.OUTER_DIAM[sizes]*1000)
+        dF_dsize = -(G/D["A"])*dA_dsize*stretch*elongation[k]
+        dF_dsize[g] += (G[g]/D["A"][g])*dA_dsize[g]*elongation[k, g]
+        dF_dend = -(G/Le)[:, None]*(dLam*elongation[k][:, None] + dU[k]*stretch[:, None] -
+                                    3*(stretch*elongation[k])[:, None]*T.T)
+        dF_dend[g] += (G[g]/Le[g])*(dU[k, g] - 2*elongation[k, g]*T[:, g])
+
+        # Every form of the factor of safety is inversely proportional to the member force. Buckling also depends
+        # on the moment of inertia and the length of the member, yielding on its area.
+        dfos_dsize = -fos/F*dF_dsize
+        dfos_dend = -fos/F*dF_dend
+        if buckling:
+            dfos_dsize[g] += fos*4/(self.OUTER_DIAM[sizes[g] - 1]*1000)
+            dfos_dend[g] -= 2*fos/Le[g]*T[:, g]
+        else:
+            dfos_dsize[g] += fos*dA_dsize[g]/self.AREA_SEC[sizes[g]]
+        for end, sign in [(1, 1.0), (0, -1.0)]:
+            for axis in range(d):
+                dfos_dcoord[:, axis] += sign*np.bincount(H[end], weights=dfos_dend[:, axis], minlength=self.n)
+
+        return dmass_dsize, dfos_dsize, dmass_dcoord, dfos_dcoord
+
+    def _descent_move(self, min_shift, max_shift):
+        # Moves a joint, picked with probability proportional to the slope of the quality there, down that slope.
+        # The step is random but no longer than the first-order estimate of where the lowest factor of safety
+        # reaches the target, so that feasible designs stay feasible and infeasible ones do not overshoot.
+        dmass_dsize, dfos_dsize, dmass_dcoord, dfos_dcoord = self.sensitivities()
+        fos = np.min(self.fos)
+        shortfall = max(0.0, self.target_fos - fos)
+        joints = np.array(self.moveable_joints, dtype=int)
+        slope = (dmass_dcoord - 2*self.fos_penalty*self.fos_penalty*shortfall*dfos_dcoord)[joints, :2]
+        norms = np.sqrt(np.sum(slope*slope, axis=1))
+        if len(joints) == 0 or not np.sum(norms) > 0:
+            return None
+        i = min(np.searchsorted(np.cumsum(norms), random.random()*np.sum(norms), side='right'), len(joints) - 1)
+        direction = -slope[i]/norms[i]
+
+        rate = np.dot(dfos_dcoord[joints[i], :2], direction)
+        limit = max_shift
+        if shortfall > 0 and rate > 0:
+            limit = shortfall/rate
+        elif shortfall == 0 and rate < 0:
+            limit = (fos - self.target_fos)/-rate
+        step = random.uniform(min_shift, min(max(limit, min_shift), max_shift))
+        return joints[i], [step*direction[0], step*direction[1], 0]
+
+    def _descent_resize(self, min_size, max_size):
+        # Infeasible designs enlarge a member that raises the lowest factor of safety, picked with probability
+        # proportional to the gain per unit of mass, by the first-order estimate of the sizes needed to close the
+        # shortfall. Feasible designs shrink a member, picked by the mass it would save, as far as neither its own
+        # factor of safety nor the estimate of the lowest one drops below the target.
+        dmass_dsize, dfos_dsize, dmass_dcoord, dfos_dcoord = self.sensitivities()
+        fos = np.min(self.fos)
+        sizes = self.sizes.astype(int)
+        if fos < self.target_fos:
+            # Only members that add mass are weighed, so degenerate zero-length ones never divide by zero
+            active = (dfos_dsize > 0) & (sizes < max_size) & (dmass_dsize > 0)
+            weights = np.zeros(self.m)
+            weights[active] = dfos_dsize[active]/dmass_dsize[active]
+        else:
+            weights = np.where(sizes > min_size + 1, dmass_dsize, 0.0)
+        if not np.sum(weights) > 0:
+            return None
+        member = min(np.searchsorted(np.cumsum(weights), random.random()*np.sum(weights), side='right'), self.m - 1)
+        size = sizes[member]
+
+        if fos < self.target_fos:
+            return member, min(size + int(math.ceil((self.target_fos - fos)/dfos_dsize[member])), int(max_size))
+
+        # Yield scales with the area and buckling with the moment of inertia, so the smaller of the two ratios
+        # bounds the member's own factor of safety at a smaller size
+        smaller = np.arange(int(min_size) + 1, size)
+        ratio = np.minimum(self.AREA_SEC[smaller]/self.AREA_SEC[size], self.I_SEC[smaller - 1]/self.I_SEC[size - 1])
+        allowed = smaller[self.fos[member]*ratio >= self.target_fos]
+        if dfos_dsize[member] > 0:
+            allowed = allowed[fos - dfos_dsize[member]*(size - allowed) >= self.target_fos]
+        if len(allowed) == 0:
+            return None
+        return member, random.randint(allowed[0], size - 1)
+
+    def _analysis_data(self, support, geometry=None):
+        D = {}
 
-        # Calculate lengths
-        L = np.zeros(self.m)
-        for i in range(self.m):
-            L[i] = np.linalg.norm(D["Coord"][:, D["Con"][0, i]] - D["Coord"][:, D["Con"][1, i]])
+        # Every joint but the supports is held in z, so planar designs only need the x and y degrees of freedom
+        d = 2 if self.planar_analysis and not np.any(self.coord[:, 2]) else 3
+        topology = self._topology_data(support, d)
+        for key in ("Re", "Load", "ff", "Loadff", "Con", "Dof"):
+            D[key] = topology[key]
 
-        # Calculate FOS's
-        self.fos = np.zeros(self.m)
-        for i in range(len(self.force)):
-            self.fos[i] = D["A"][i] * self.Fy / self.force[i]
-            if self.fos[i] < 0:
-                self.fos[i] = min(math.pi * math.pi * self.E * self.I_SEC[int(self.sizes[i] - 1)] / (L[i] * L[i]) / -self.force[i],
-                                  -self.fos[i])
+        # Add the area information from truss structure
+        D["A"] = self.AREA_SEC[self.sizes.astype(int)]
+        D["Coord"] = self.coord.T[:d]
+        D["E"] = self.E * np.ones(self.m)
+        if geometry is None:
+            geometry = self._member_geometry()
+        D["C"] = geometry[0][:d]
+        D["L"] = geometry[1]
+
+        return D
+
+    def _member_fos(self, force, sizes, L):
+        # Axial yield, or the lower of yield and Euler buckling for members in compression. Works row by row on
+        # stacked forces and sizes.
+        # Sizes are truncated to catalog indices the same way int() does, including the one-off index used for
+        # the moment of inertia
+        sizes = np.asarray(sizes)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fos = self.AREA_SEC[sizes.astype(int)] * self.Fy / force
+            buckling = math.pi * math.pi * self.E * self.I_SEC[(sizes - 1).astype(int)] / (L * L) / -force
+        fos = np.where(fos < 0, np.minimum(buckling, -fos), fos)
 
         # Make sure loads and supports are connected
-        for i in range(3):
-            if np.size(np.where(self.con == i)) == 0:
-                self.fos = np.zeros(self.m)
+        if not np.all(np.isin(self.fixed_joints + self.force_joints, self.con)):
+            fos[...] = 0.0
+
+        fos[np.isnan(np.sum(fos, axis=-1))] = 0.0
+        fos[np.isinf(fos)] = pow(10, 10)
 
-        if np.isnan(sum(self.fos)):
-            self.fos = np.zeros(self.m)
+        return fos
 
-        for i in range(self.m):
-            if np.isinf(self.fos[i]):
-                self.fos[i] = pow(10, 10)
+    def _single_fos_eval(self, support, geometry=None):
+        D = self._analysis_data(support, geometry)
+
+        # Do force analysis, unless the members alone show that the truss is a mechanism, which gets the same
+        # penalty as a singular stiffness matrix
+        try:
+            if self._is_mechanism():
+                raise np.linalg.LinAlgError('Mechanism')
+            force, U, R = self._force_eval(D)
+        except np.linalg.LinAlgError:
+            force = np.ones([len(self.load_cases), self.m]) * pow(10, 16)
+            self.stable = False
+
+        # Factors of safety in every load case, and each member's force and factor of safety in the case that
+        # governs it
+        self.case_fos = self._member_fos(force, self.sizes, D["L"])
+        governing = np.argmin(self.case_fos, axis=0)
+        self.fos = self.case_fos[governing, np.arange(self.m)]
+        self.force = force[governing, np.arange(self.m)]
+
+    def _topology_data(self, support, d):
+        # Everything in the analysis that depends only on the joints, members, supports and loads, rebuilt when
+        # any of them changes. Copies share it, and the arrays are never written to. The joint order of the
+        # sparse solver is added to it the first time one is needed.
+        topology = self._topology
+        if topology is not None and topology["d"] == d and np.array_equal(topology["support"], support) and \
+                topology["load_cases"] == self.load_cases:
+            return topology
+
+        topology = {"d": d, "support": np.copy(support), "load_cases": [dict(case) for case in self.load_cases]}
+        topology["Re"] = np.hstack([support[:d], np.tile(np.array([[0], [0], [1]])[:d], (1, self.n - 2))])
+
+        # The loads, one d x n array per load case
+        topology["Load"] = np.zeros([len(self.load_cases), d, self.n])
+        for k, load_case in enumerate(self.load_cases):
+            for joint, load in load_case.items():
+                topology["Load"][k, :, joint] = load[:d]
+
+        # Free degrees of freedom, the loads on them and the degrees of freedom at the ends of every member
+        topology["ff"] = np.where((1.0 - topology["Re"]).T.flat == 1)[0]
+        topology["Loadff"] = self._free_loads(topology, topology["ff"])
+        topology["Con"] = self.con.T.astype(int)
+        topology["Dof"] = self._member_dofs(topology["Con"], d)
+
+        self._topology = topology
+        return topology
+
+    def _is_mechanism(self):
+        # Decided once per topology, for trusses held in x and y only at fully pinned supports. Any other support
+        # pattern is left to the analysis.
+        topology = self._topology
+        if not self.rigidity_check or topology is None:
+            return False
+        if "Mechanism" not in topology:
+            planar = topology["Re"][:2]
+            supports = np.nonzero(np.all(planar == 1, axis=0))[0]
+            if np.count_nonzero(planar) == 2*len(supports):
+                topology["Mechanism"] = truss.rigidity.is_mechanism(self.n, topology["Con"].T, supports)
+            else:
+                topology["Mechanism"] = False
+        return topology["Mechanism"]
+
+    @staticmethod
+    def _member_dofs(H, d):
+        # Global degrees of freedom touched by each member, those of its first joint followed by its second
+        return np.hstack([d*H[0][:, None] + np.arange(d), d*H[1][:, None] + np.arange(d)])
+
+    @staticmethod
+    def _free_loads(D, ff):
+        # Loads on the free degrees of freedom, one column per load case
+        if len(D["Load"]) == 0:
+            raise ValueError('load_cases must hold at least one load case')
+        return D["Load"].transpose(0, 2, 1).reshape(len(D["Load"]), -1)[:, ff].T
 
     def _force_eval(self, D):
-        Tj = np.zeros([3, np.size(D["Con"], axis=1)])
         w = np.array([np.size(D["Re"], axis=0), np.size(D["Re"], axis=1)])
-        SS = np.zeros([3*w[1], 3*w[1]])
-        U = 1.0 - D["Re"]
-
-        # This identifies joints that are unsupported, and can therefore be loaded
-        ff = np.where(U.T.flat == 1)[0]
-
-        # Step through the each member in the truss, and build the global stiffness matrix
-        for i in range(np.size(D["Con"], axis=1)):
-            H = D["Con"][:, i]
-            C = D["Coord"][:, H[1]] - D["Coord"][:, H[0]]
-            Le = np.linalg.norm(C)
-            T = C/Le
-            s = np.outer(T, T)
-            G = D["E"][i]*D["A"][i]/Le
-            ss = G*np.concatenate((np.concatenate((s, -s), axis=1), np.concatenate((-s, s), axis=1)), axis=0)
-            Tj[:, i] = G*T
-            e = list(range(int(3*H[0]), int(3*H[0] + 3))) + list(range(int(3*H[1]), int(3*H[1] + 3)))
-            for ii in range(6):
-                for j in range(6):
-                    SS[e[ii], e[j]] += ss[ii, j]
-
-        SSff = np.zeros([len(ff), len(ff)])
-        for i in range(len(ff)):
-            for j in range(len(ff)):
-                SSff[i, j] = SS[ff[i], ff[j]]
-
-        Loadff = D["Load"].T.flat[ff]
-
-        Uff = np.linalg.solve(SSff, Loadff)
-
-        ff = np.where(U.T==1)
-        for i in range(len(ff[0])):
-            U[ff[1][i], ff[0][i]] = Uff[i]
-        F = np.sum(np.multiply(Tj, U[:, D["Con"][1, :].astype(int)] - U[:, D["Con"][0, :].astype(int)]), axis=0)
-        if np.linalg.cond(SSff) > pow(10, 10):
+
+        # Degrees of freedom of unsupported joints, which can therefore be loaded. Every load case is solved
+        # against the same factorization, as the columns of one right-hand side.
+        ff = D["ff"]
+        Loadff = D["Loadff"]
+
+        H, T, Le, G = self._member_stiffness(D)
+        Tj = G*T
+
+        # Designs close to the last factorized one are solved with a low-rank update of its factorization
+        solver = self._select_solver(w[1])
+        SS = None
+        Uff = None
+        if solver != 'dense' and self.low_rank_updates:
+            Uff = self.reanalysis.solve(D, ff, Loadff, T, G)
+        if Uff is not None:
+            ill_conditioned = False
+        elif solver == 'dense':
+            SS = self._assemble_stiffness(H, T, G, w[1], dof=D["Dof"])
+
+            # Pull out the rows and columns of the free degrees of freedom
+            SSff = SS[np.ix_(ff, ff)]
+
+            Uff = np.linalg.solve(SSff, Loadff)
+            ill_conditioned = np.linalg.cond(SSff) > pow(10, 10)
+        else:
+            # Build the global stiffness matrix from all members at once and factor its free block
+            SS = self._assemble_stiffness(H, T, G, w[1], sparse=(solver == 'sparse'), dof=D["Dof"])
+            try:
+                if solver == 'sparse':
+                    SSff = SS[ff][:, ff].tocsc()
+                    factor_solve, rcond = self._sparse_factor(SSff, ff, D["Con"], w[1], w[0])
+                else:
+                    SSff = SS[np.ix_(ff, ff)]
+                    factor_solve, rcond = self._cholesky_factor(SSff)
+            except np.linalg.LinAlgError:
+                if solver == 'sparse':
+                    raise
+                # The matrix is not positive definite, so the truss is a mechanism. Fall back to a general solve
+                # so the usual penalty is applied to whatever forces come out of it.
+                Uff = np.linalg.solve(SSff, Loadff)
+                ill_conditioned = True
+            else:
+                Uff = factor_solve(Loadff)
+                ill_conditioned = rcond < pow(10, -10)
+                self.reanalysis.store(D, ff, Loadff, T, G, SSff, factor_solve, rcond, Uff)
+
+        # Displacements, member forces and reactions, stacked case-first
+        Ufull = np.zeros([len(D["Load"]), w[0]*w[1]])
+        Ufull[:, ff] = Uff.T
+        U = Ufull.reshape([len(D["Load"]), w[1], w[0]]).transpose(0, 2, 1)
+        F = np.sum(np.multiply(Tj, U[:, :, H[1]] - U[:, :, H[0]]), axis=1)
+
+        if SS is not None:
+            R = SS.dot(Ufull.T).T.reshape([len(D["Load"]), w[1], w[0]]).transpose(0, 2, 1)
+        else:
+            # Without an assembled matrix, the reactions are the member forces gathered at the joints
+            R = np.zeros([len(D["Load"]), w[0], w[1]])
+            for k in range(len(D["Load"])):
+                for d in range(w[0]):
+                    R[k, d] = np.bincount(H[1], weights=F[k]*T[d], minlength=w[1]) - \
+                        np.bincount(H[0], weights=F[k]*T[d], minlength=w[1])
+
+        # Near-mechanisms are penalized and flagged as unstable
+        if ill_conditioned:
             F *= pow(10, 10)
-        R = np.sum(SS*U.T.flat[:], axis=1).reshape([w[1], w[0]]).T
+        self.stable = not ill_conditioned
 
         return F, U, R
 
+    def _select_solver(self, n):
+        if sps is None:
+            return 'dense'
+        elif self.solver != 'auto':
+            return self.solver
+        elif n > self.sparse_threshold:
+            return 'sparse'
+        return 'cholesky'
+
+    @staticmethod
+    def _member_stiffness(D):
+        H = np.asarray(D["Con"], dtype=int)
+
+        # Direction cosines and axial stiffness of every member
+        C = D["C"]
+        Le = D["L"]
+        T = C/Le
+        G = D["E"]*np.asarray(D["A"])/Le
+
+        return H, T, Le, G
+
+    @staticmethod
+    def _assemble_stiffness(H, T, G, n, sparse=False, dof=None):
+        # Element matrices, stacked member-first as [[s, -s], [-s, s]]. A two-dimensional G stacks one matrix per
+        # row of member stiffnesses. The number of rows of T gives the degrees of freedom per joint, and dof can
+        # pass in the degrees of freedom of the members when they are already known.
+        d = len(T)
+        s = G[..., None, None]*np.einsum('im,jm->mij', T, T)
+        ss = np.concatenate((np.concatenate((s, -s), axis=-1), np.concatenate((-s, s), axis=-1)), axis=-2)
+
+        e = Truss._member_dofs(H, d) if dof is None else dof
+        size = d*n
+
+        if sparse:
+            # Duplicate entries are summed when the triplets are converted to CSR
+            rows = np.repeat(e, 2*d, axis=1)
+            cols = np.tile(e, (1, 2*d))
+            return sps.csr_matrix((ss.ravel(), (rows.ravel(), cols.ravel())), shape=(size, size))
+
+        # Scatter every element into the global matrix with a single accumulate. Keeping members as the
+        # outer axis makes the additions happen in the same order as a member-by-member loop.
+        idx = e[:, :, None]*size + e[:, None, :]
+        if np.ndim(G) > 1:
+            idx = (idx + size*size*np.arange(len(G))[:, None, None, None]).ravel()
+            SS = np.bincount(idx, weights=ss.ravel(), minlength=size*size*len(G))
+            return SS.reshape([len(G), size, size])
+        return np.bincount(idx.ravel(), weights=ss.ravel(), minlength=size*size).reshape([size, size])
+
+    @staticmethod
+    def _cholesky_factor(SSff):
+        factor = sla.cho_factor(SSff, check_finite=False)
+
+        # LAPACK estimate of the reciprocal 1-norm condition number, reusing the Cholesky factor
+        rcond, _ = lapack.dpocon(factor[0], np.abs(SSff).sum(axis=0).max())
+
+        return lambda b: sla.cho_solve(factor, b, check_finite=False), rcond
+
+    def _sparse_factor(self, SSff, ff, con, n, d):
+        # Renumber the free degrees of freedom so the factor stays close to a band matrix
+        if self.renumber_joints:
+            # The order only depends on the topology, so it is kept with the rest of it
+            topology = self._topology
+            if topology is not None and con is topology["Con"] and d == topology["d"]:
+                if "Order" not in topology:
+                    topology["Order"] = self._bandwidth_order(con, n, d, ff)
+                perm = topology["Order"]
+            else:
+                perm = self._bandwidth_order(con, n, d, ff)
+            try:
+                lu = spla.splu(SSff[perm][:, perm], permc_spec='NATURAL', diag_pivot_thresh=0.0)
+            except RuntimeError:
+                raise np.linalg.LinAlgError('Singular stiffness matrix')
+
+            def factor_solve(b):
+                x = np.empty_like(b)
+                x[perm] = lu.solve(b[perm])
+                return x
+        else:
+            try:
+                lu = spla.splu(SSff)
+            except RuntimeError:
+                raise np.linalg.LinAlgError('Singular stiffness matrix')
+            factor_solve = lu.solve
+
+        # Estimate the 1-norm condition number from the factorization instead of a dense SVD
+        inverse = spla.LinearOperator(SSff.shape, matvec=lu.solve, rmatvec=lambda b: lu.solve(b, trans='T'),
+                                      dtype=float)
+        rcond = 1.0/(spla.onenormest(SSff)*spla.onenormest(inverse))
+
+        return factor_solve, rcond
+
+    @staticmethod
+    def _bandwidth_order(con, n, d, ff):
+        # Reverse Cuthill-McKee ordering of the joints, expanded to their d free degrees of freedom
+        H = np.asarray(con).astype(int)
+        adjacency = sps.csr_matrix((np.ones(2*np.size(H, axis=1)), (np.hstack([H[0], H[1]]), np.hstack([H[1], H[0]]))),
+                                   shape=(n, n))
+        joint_order = reverse_cuthill_mckee(adjacency, symmetric_mode=True)
+        dof_order = (d*joint_order[:, None] + np.arange(d)).ravel()
+        position = -np.ones(d*n, dtype=int)
+        position[ff] = np.arange(len(ff))
+        perm = position[dof_order]
+        return perm[perm >= 0]
+
     # Lower-tier rules below
 
     # LT rule 1
@@ -348,18 +966,20 @@ class Truss(AbstractBaseSolution):
         self.change_member_size(len(self.sizes)-1, dsize)
 
         # Add member between new joint and any joint that previous connection joints share
-        for i in range(0, len(self.con_mat)):
-            if self.con_mat[i, joint_a] == 1.0 and self.con_mat[i, joint_b] == 1.0 and i != new_joint:
+        for i in sorted(self.neighbors(joint_a) & self.neighbors(joint_b)):
+            if i != new_joint:
                 self.add_member(i, new_joint)
 
     # LT rule 2
     def join_free_members_rule(self, set_to_join):
         print('join:', set_to_join)
+        last = self.n - 1
         self.remove_joint(set_to_join[0])
-        if set_to_join[1] > set_to_join[0]:
-            set_to_join[1] -= 1
-        if set_to_join[2] > set_to_join[0]:
-            set_to_join[2] -= 1
+        # The last joint was renumbered into the removed joint's place
+        if set_to_join[1] == last:
+            set_to_join[1] = set_to_join[0]
+        if set_to_join[2] == last:
+            set_to_join[2] = set_to_join[0]
         self.add_member(set_to_join[1], set_to_join[2])
 
     # LT rule 3
@@ -461,6 +1081,47 @@ class Truss(AbstractBaseSolution):
             size_change = standardization_rate*(base_member_size - member_size)
             self.change_member_size_rule(member_index, size_change)
 
+    # HT rule 6
+    def fully_stressed_design_rule(self, max_iterations):
+        # Resizes every member to the smallest catalog size that keeps it at the target factor of safety under the
+        # forces of the current sizes, and repeats with the new forces until the sizes settle. The lightest sizing
+        # that was feasible in its own analysis is kept. Mechanisms are left as they are.
+        support = np.array([[1, 1, 1], [1, 1, 1]]).T
+        D = self._analysis_data(support)
+        if self._is_mechanism():
+            return
+        L = D["L"]
+        sizes = self.sizes.astype(int)
+        best = None
+        for iteration in range(max_iterations):
+            try:
+                force, _, _ = self._force_eval(dict(D, A=self.AREA_SEC[sizes]))
+            except np.linalg.LinAlgError:
+                self.stable = False
+            if not self.stable:
+                if best is None:
+                    return
+                break
+            mass = np.dot(L, self.WEIGHT[sizes])
+            if np.min(self._member_fos(force, sizes, L)) >= self.target_fos and (best is None or mass < best[0]):
+                best = (mass, sizes)
+
+            # Yield sets the area every member needs, and Euler buckling the moment of inertia of the size below
+            # for members in compression
+            magnitude = np.max(abs(force), axis=0)
+            compression = np.max(np.maximum(-force, 0.0), axis=0)
+            yielding = np.searchsorted(self.AREA_SEC, self.target_fos*magnitude/self.Fy)
+            buckling = np.searchsorted(self.I_SEC, self.target_fos*compression*L*L/(math.pi*math.pi*self.E)) + 1
+            resized = np.clip(np.maximum(yielding, buckling), 1, len(self.AREA_SEC) - 1)
+            if np.array_equal(resized, sizes):
+                break
+            sizes = resized
+
+        if best is not None:
+            sizes = best[1]
+        for member_index in range(self.m):
+            self.change_member_size_rule(member_index, sizes[member_index] - self.sizes[member_index])
+
     # Lower-tier random rule selection
     def lowtier_rule_select(self):
         rule = random.randint(1, self.num_lowtier_rules)
@@ -508,35 +1169,11 @@ class Truss(AbstractBaseSolution):
             if kwargs.get('coord') is not None:
                 coord = kwargs['coord']
             else:
-                min_x = 10
-                max_x = -10
-                min_y = 10
-                max_y = -10
-                for joint in self.coord:
-                    if joint[0] < min_x:
-                        min_x = joint[0]
-                    if joint[0] > max_x:
-                        max_x = joint[0]
-                    if joint[1] < min_y:
-                        min_y = joint[0]
-                    if joint[1] > max_y:
-                        max_y = joint[0]
-
+                min_x, min_y = np.min(self.coord[:, :2], axis=0)
+                max_x, max_y = np.max(self.coord[:, :2], axis=0)
                 coord = [random.uniform(min_x - max_new_dist, max_x + max_new_dist), random.uniform(min_y - max_new_dist, max_y + max_new_dist), 0]
 
-            connection_list = []
-
-            for i in range(len(self.coord)):
-                test_node = self.coord[i]
-                intersection = False
-                for j in range(len(self.con)):
-                    a = self.coord[self.con[j][0]]
-                    b = self.coord[self.con[j][1]]
-
-                    if self.check_for_line_intersection(coord, test_node, a, b):
-                        intersection = True
-                if not intersection:
-                    connection_list.append(i)
+            connection_list = self.visible_joints(coord)
 
             self.add_free_joint_rule(coord, connection_list)
             self.applied_rules.append('L3')
@@ -562,48 +1199,64 @@ class Truss(AbstractBaseSolution):
                 self.switch_diagonal_member_joints_rule(member_index, new_joint_a, new_joint_b)
                 self.applied_rules.append('L5')
 
-        # Move free joint
+        # Move free joint, down the slope of the quality when gradient rules are on
         elif rule == 6:
-            if kwargs.get('joint') is not None:
-                joint = kwargs['joint']
+            step = None
+            if self.gradient_rules and all(kwargs.get(key) is None for key in ('joint', 'coord', 'd_coord')):
+                step = self._descent_move(min_coord_shift, max_coord_shift)
+            if step is not None:
+                joint, d_coord = step
             else:
-                joint_index = random.randint(0, len(self.moveable_joints)-1)
-                joint = self.moveable_joints[joint_index]
-                print('joint', joint)
-            if kwargs.get('coord') is not None:
-                new_coord = kwargs['coord']
-                old_coord = self.coord[joint]
-                d_coord = new_coord - old_coord
-            elif kwargs.get('d_coord') is not None:
-                d_coord = kwargs['d_coord']
-            else:
-                d_x = pow(-1,random.randint(1, 2))*random.uniform(min_coord_shift, max_coord_shift)
-                d_y = pow(-1,random.randint(1, 2))*random.uniform(min_coord_shift, max_coord_shift)
-                d_coord = [d_x, d_y, 0]
+                if kwargs.get('joint') is not None:
+                    joint = kwargs['joint']
+                else:
+                    joint_index = random.randint(0, len(self.moveable_joints)-1)
+                    joint = self.moveable_joints[joint_index]
+                    print('joint', joint)
+                if kwargs.get('coord') is not None:
+                    new_coord = kwargs['coord']
+                    old_coord = self.coord[joint]
+                    d_coord = new_coord - old_coord
+                elif kwargs.get('d_coord') is not None:
+                    d_coord = kwargs['d_coord']
+                else:
+                    d_x = pow(-1,random.randint(1, 2))*random.uniform(min_coord_shift, max_coord_shift)
+                    d_y = pow(-1,random.randint(1, 2))*random.uniform(min_coord_shift, max_coord_shift)
+                    d_coord = [d_x, d_y, 0]
+
             self.move_free_joint_rule(joint, d_coord)
-            attempts = 1
+
+            # A chosen move that takes a member across another is cut back to a random point of the way the joint
+            # can travel freely in the same direction, rather than drawn again. Displacements that were passed in
+            # are only taken back, as is a move that is somehow still invalid.
             if not self.is_valid():
-                while not self.is_valid():
-                    d_x = pow(-1, random.randint(1, 2)) * random.uniform(min_coord_shift, max_coord_shift) - d_coord[0]
-                    d_y = pow(-1, random.randint(1, 2)) * random.uniform(min_coord_shift, max_coord_shift) - d_coord[1]
-                    d_coord = [d_x, d_y, 0]
+                self.move_free_joint_rule(joint, [-x for x in d_coord])
+                if kwargs.get('coord') is None and kwargs.get('d_coord') is None:
+                    scale = random.uniform(0.0, self.joint_travel(joint, d_coord))
+                    d_coord = [scale*x for x in d_coord]
                     self.move_free_joint_rule(joint, d_coord)
-                    attempts += 1
-                    if attempts > 100:
-                        break
+                    if not self.is_valid():
+                        self.move_free_joint_rule(joint, [-x for x in d_coord])
             self.applied_rules.append('L6')
 
-        # Resize member
+        # Resize member, along the sensitivities of the design when gradient rules are on
         elif rule == 7:
-            if kwargs.get('member') is not None:
-                member = kwargs['member']
-            else:
-                member = random.randint(0, len(self.con)-1)
+            step = None
+            if self.gradient_rules and kwargs.get('member') is None and kwargs.get('size') is None:
+                step = self._descent_resize(min_size, max_size)
 
-            if kwargs.get('size') is not None:
-                new_size = kwargs['size']
+            if step is not None:
+                member, new_size = step
             else:
-                new_size = random.randint(min_size, max_size)
+                if kwargs.get('member') is not None:
+                    member = kwargs['member']
+                else:
+                    member = random.randint(0, len(self.con)-1)
+
+                if kwargs.get('size') is not None:
+                    new_size = kwargs['size']
+                else:
+                    new_size = random.randint(min_size, max_size)
 
             old_size = self.sizes[member]
             d_size = new_size - old_size
@@ -620,6 +1273,7 @@ class Truss(AbstractBaseSolution):
         max_scale_multiplier = 1.25
         min_standardization_rate = 0.20
         max_standardization_rate = 1.00
+        max_sizing_iterations = 10
 
         valid_rule = False
 
@@ -678,353 +1332,130 @@ class Truss(AbstractBaseSolution):
             self.standardize_rule(standardization_rate, base_member)
             self.applied_rules.append('H5')
 
-    # Function used to identify where rules can be applied
-    def rule_check(self):
-        #TODO: CHECK THIS
-        # Check which joints can be deleted
-        self.deletable_joints = []
-        for joint_index in range(0, len(self.con_mat)):
-            deletable = True
-            for check_index in range(0, len(self.con_mat)):
-                if self.con_mat[joint_index, check_index] == 1.0:
-                    if sum(self.con_mat[check_index]) < 3.0:
-                        deletable = False
-                        break
-            if deletable and joint_index not in self.undeletable_joints:
-                self.deletable_joints.append(joint_index)
-
-        # Check which joints can be deleted to join members
-        self.joinable_sets = []
-        for joint_index in range(0, len(self.coord)):
-            connected_joints = self.con_mat[joint_index]
-            for i in range(len(connected_joints)):
-                connection = connected_joints[i]
-                if connection == 1:
-                    i_mat = self.con_mat[i]
-                    for j in range(len(i_mat)):
-                        if j != joint_index and j != i:
-                            match = 0
-                            j_mat = self.con_mat[j]
-                            if j_mat[joint_index] == 1:
-                                for k in range(len(i_mat)):
-                                    if i_mat[k] == j_mat[k] and i_mat[k] == 1:
-                                        match += 1
-                                if match >= 2 and i_mat[j] != 1:
-                                    set = [joint_index, i, j]
-                                    already_in_set = False
-                                    for check in self.joinable_sets:
-                                        if check[0] == set[0]:
-                                            if (check[1] == set[1] and check[2] == set[2]) or (check[1] == set[2] and check[2] == set[1]):
-                                                already_in_set = True
-                                    if not already_in_set and set[0] not in self.undeletable_joints:
-                                        self.joinable_sets.append(set)
-
-        # Check to see if performing join function would leave nodes with only 1 member
-        removable_list_sets = []
-        for set_index in range(len(self.joinable_sets)):
-            set = self.joinable_sets[set_index]
-            for i in range(len(self.con_mat)):
-                leftover = sum(self.con_mat[i]) - self.con_mat[i][set[0]]
-                if i == set[1] or i == set[2]:
-                    leftover += 1
-                if leftover < 2:
-                    removable_list_sets.append(set_index)
-                    break
-        while len(removable_list_sets) > 0:
-            del self.joinable_sets[removable_list_sets[0]]
-            del removable_list_sets[0]
-            for i in range(len(removable_list_sets)):
-                removable_list_sets[i] -= 1
-
-        # Check joinable sets to see if there is collision with new members
-        removable_list_sets = []
-        for set_index in range(len(self.joinable_sets)):
-            set = self.joinable_sets[set_index]
-            node_a = self.coord[set[1]]
-            node_b = self.coord[set[2]]
-
-            for con in self.con:
-                node_c = self.coord[con[0]]
-                node_d = self.coord[con[1]]
-                #
-                # print('a', set[1])
-                # print('b', set[2])
-                # print('c', con[0])
-                # print('d', con[1])
-
-                if not ((set[1] == con[0] and set[2] == con[1]) or (set[1] == con[1] and set[2] == con[0])):
-                    intersection = self.check_for_line_intersection(node_a, node_b, node_c, node_d)
-                    # TODO: CHECK THIS!
-                    if set[0] == con[0] or set[0] == con[1]:
-                        intersection = False
-                    if intersection:
-                        removable_list_sets.append(set_index)
-                        break
-        while len(removable_list_sets) > 0:
-            del self.joinable_sets[removable_list_sets[0]]
-            del removable_list_sets[0]
-            for i in range(len(removable_list_sets)):
-                removable_list_sets[i] -= 1
-
-        # Check which diagonal members can be repositioned
-        self.re_diagonable_members = []
-        for member_index in range(0, len(self.con)):
-            member = self.con[member_index]
-            check_a = self.con_mat[member[0]]
-            check_b = self.con_mat[member[1]]
-            match = []
-            for i in range(0, len(check_a)):
-                if check_a[i] == check_b[i] and check_a[i] == 1:
-                    match.append(i)
-            if len(match) >= 2:
-                pairs = []
-                for j in range(0, len(match)):
-                    a = match[j]
-                    for k in range(0, len(match)):
-                        b = match[k]
-                        if a != b and a < b:
-                            pairs.append((a, b))
-                for pair in pairs:
-                    self.re_diagonable_members.append([member_index, member, pair])
-
-        # Check to see if any potential new member already exists
-        removable_list_members = []
-        for test_member_index in range(len(self.re_diagonable_members)):
-            test_member = self.re_diagonable_members[test_member_index][2]
-            for check_member_index in range(len(self.con)):
-                check_member = self.con[check_member_index]
-                if (test_member[0] == check_member[0] and test_member[1] == check_member[1]) or (test_member[0] == check_member[1] and test_member[1] == check_member[0]):
-                    removable_list_members.append(test_member_index)
-        while len(removable_list_members) > 0:
-            del self.re_diagonable_members[removable_list_members[0]]
-            del removable_list_members[0]
-            for i in range(len(removable_list_members)):
-                removable_list_members[i] -= 1
-
-        # Check re-diagonable members to see if there is collision with existing members
-        removable_list_members = []
-        for member_index in range(len(self.re_diagonable_members)):
-            member = self.re_diagonable_members[member_index]
-            node_a_index = member[2][0]
-            node_b_index = member[2][1]
-            node_a = self.coord[node_a_index]
-            node_b = self.coord[node_b_index]
-
-            mem_to_delete = member[1]
-
-            for con in self.con:
-                node_c_index = con[0]
-                node_d_index = con[1]
-                node_c = self.coord[node_c_index]
-                node_d = self.coord[node_d_index]
-
-                intersection = self.check_for_line_intersection(node_a, node_b, node_c, node_d)
-                if (node_c_index == member[1][0] and node_d_index == member[1][1]) or (node_c_index == member[1][1] and node_d_index == member[1][0]):
-                    intersection = False
-                if intersection:
-                    removable_list_members.append(member_index)
-                    break
-        while len(removable_list_members) > 0:
-            del self.re_diagonable_members[removable_list_members[0]]
-            del removable_list_members[0]
-            for i in range(len(removable_list_members)):
-                removable_list_members[i] -= 1
-
-        # Check which joints can be moved
-        self.moveable_joints = []
-        for i in range(len(self.coord)):
-            if i not in self.undeletable_joints:
-                self.moveable_joints.append(i)
-
-        # Check which patterns are valid
-        self.patterns = []
-        potential_patterns = []
-        for i in range(len(self.con)):
-            member = self.con[i]
-            joint_a = member[0]
-            joint_b = member[1]
-            for j in range(len(self.con_mat)):
-                if self.con_mat[joint_a][j] == 1.0 and self.con_mat[joint_b][j] == 1.0:
-                    potential_patterns.append([joint_a, joint_b, j])
-        # Identify locations of patterns
-        for i in range(len(potential_patterns)):
-            pattern = potential_patterns[i]
-            coord_a = self.coord[pattern[0]]
-            coord_b = self.coord[pattern[1]]
-            coord_c = self.coord[pattern[2]]
-
-            # Figure out coordinates of reflected point c
-            if coord_b[0] - coord_a[0] != 0 and coord_b[1] - coord_a[1] != 0:
-                m1 = (coord_b[1]-coord_a[1])/(coord_b[0]-coord_a[0])
-                b1 = coord_a[1] - m1*coord_a[0]
-                m2 = -1/m1
-                b2 = coord_c[1] - m2*coord_c[0]
-                x_int = (b2 - b1)/(m1-m2)
-                dx = coord_c[0] - x_int
-                x_new = x_int - dx
-                y_new = m2*x_new + b2
-            elif coord_b[1] - coord_a[1] == 0:
-                x_new = coord_c[0]
-                dy = coord_c[1] - coord_a[1]
-                y_new = coord_a[1] - dy
+        # Fully stressed design
+        elif rule == 6:
+            if kwargs.get('max_iterations') is not None:
+                max_iterations = kwargs['max_iterations']
             else:
-                dx = coord_c[0] - coord_a[0]
-                x_new = coord_a[0] - dx
-                y_new = coord_c[1]
-
-            coord_d = [x_new, y_new, 0]
-            self.patterns.append([coord_d, pattern[0], pattern[1]])
-
-        # Check patterns to see if there is any collisions with existing members
-        removable_list_patterns = []
-        for pattern_index in range(len(self.patterns)):
-            pattern = self.patterns[pattern_index]
-            new_node_coord = pattern[0]
-            node_a = self.coord[pattern[1]]
-            node_b = self.coord[pattern[2]]
-
-            for member in self.con:
-                node_c = self.coord[member[0]]
-                node_d = self.coord[member[1]]
-
-                intersection = self.check_for_line_intersection(new_node_coord, node_a, node_c, node_d)
-
-                # print('')
-                # print('new', new_node_coord)
-                # print('a', node_a)
-                # print('b', node_b)
-                # print('c', node_c)
-                # print('d', node_d)
-                # print('new/a', intersection)
-
-                if intersection:
-                    removable_list_patterns.append(pattern_index)
-                    break
-                else:
-                    intersection = self.check_for_line_intersection(new_node_coord, node_b, node_c, node_d)
-                    # print('new/b', intersection)
-                    if intersection:
-                        removable_list_patterns.append(pattern_index)
-                        break
-        while len(removable_list_patterns) > 0:
-            del self.patterns[removable_list_patterns[0]]
-            del removable_list_patterns[0]
-            for i in range(len(removable_list_patterns)):
-                removable_list_patterns[i] -= 1
-
-    # Checks entire design to ensure design is valid
-    def is_valid(self):
-        validity = True
-
-        for i in range(len(self.con)):
-            for j in range(len(self.con)):
-                if i != j:
-                    member_1 = self.con[i]
-                    member_2 = self.con[j]
-                    a_idx = member_1[0]
-                    b_idx = member_1[1]
-                    c_idx = member_2[0]
-                    d_idx = member_2[1]
-                    node_a = self.coord[a_idx]
-                    node_b = self.coord[b_idx]
-                    node_c = self.coord[c_idx]
-                    node_d = self.coord[d_idx]
-                    intersection = self.check_for_line_intersection(node_a, node_b, node_c, node_d)
-                    if a_idx == c_idx or a_idx == d_idx or b_idx == c_idx or b_idx == d_idx:
-                        intersection = False
-                    if intersection:
-                        validity = False
-                        break
-            if not validity:
-                break
+                max_iterations = max_sizing_iterations
+            self.fully_stressed_design_rule(max_iterations)
+            self.applied_rules.append('H6')
 
+    # Function used to identify where rules can be applied. Each set is only worked out when a rule first reads it,
+    # and is then kept until the design changes, so rules only pay for the sets they use.
+    def rule_check(self):
+        if self._rule_sets is None:
+            self._rule_sets = truss.rule_sets.RuleSets(self)
+
+    def _rule_list(self, kind):
+        self.rule_check()
+        if self._rule_sets.pending(kind):
+            self._own_storage()
+            self._rule_sets.update(self, kind)
+            self._rule_lists.pop(kind, None)
+        if kind not in self._rule_lists:
+            self._rule_lists[kind] = self._rule_sets.read(self, kind)
+        return self._rule_lists[kind]
+
+    @property
+    def deletable_joints(self):
+        return self._rule_list('deletable')
+
+    @property
+    def joinable_sets(self):
+        return self._rule_list('joinable')
+
+    @property
+    def re_diagonable_members(self):
+        return self._rule_list('diagonal')
+
+    @property
+    def patterns(self):
+        return self._rule_list('pattern')
+
+    @property
+    def moveable_joints(self):
+        return [i for i in range(self.n) if i not in self.undeletable_joints]
+
+    # Checks entire design to ensure design is valid. Removing members never makes a valid design invalid, so once
+    # the design has been found valid only the members added or moved since then are tested, unless full is set.
+    def is_valid(self, full=False):
+        if full or self._dirty is None:
+            validity = len(self.crossing_members()) == 0
+        else:
+            validity = True
+            for member_index in sorted(self._dirty):
+                member = self.con[member_index]
+                crossed = self.con[self.crossed_members(self.coord[member[0]], self.coord[member[1]])]
+                if np.any(np.all(np.isin(crossed, member, invert=True), axis=1)):
+                    validity = False
+                    break
+        if validity:
+            self._dirty = set()
         return validity
 
+    # Index pairs of members that intersect without sharing a joint
+    def crossing_members(self):
+        return truss.geometry.crossing_members(self.coord, self.con, self.segment_grid().pairs())
+
     # Check to see if connections between node pairs intersect
     def check_for_line_intersection(self, node_a, node_b, node_c, node_d):
-        do_intersect = False
+        return bool(truss.geometry.segments_intersect(node_a, node_b, node_c, node_d))
 
-        # If slopes and y-intercepts match, check to see if collinear lines are overlapping
-        if abs(node_b[0]-node_a[0]) > 0:
-            m1 = (node_b[1]-node_a[1])/(node_b[0]-node_a[0])
-            b1 = node_a[1] - m1 * node_a[0]
-        else:
-            m1 = 'undefined'
-            b1 = 'undefined'
-        if abs(node_d[0] - node_c[0]) > 0:
-            m2 = (node_d[1]-node_c[1])/(node_d[0]-node_c[0])
-            b2 = node_c[1] - m2 * node_c[0]
-        else:
-            m2 = 'undefined'
-            b2 = 'undefined'
-        if m1 == m2 and b1 == b2:
-            if self.is_between_values(node_a[0], node_c[0], node_d[0]) or self.is_between_values(node_b[0], node_c[0], node_d[0])\
-                    or self.is_between_values(node_c[0], node_a[0], node_b[0]) or self.is_between_values(node_d[0], node_a[0], node_b[0]):
-                    do_intersect = True
-            if (node_a[0] == node_c[0] and self.is_between_values(node_b[0], node_c[0], node_d[0])) or \
-                    (node_a[0] == node_c[0] and self.is_between_values(node_d[0], node_a[0], node_b[0])) or \
-                    (node_a[0] == node_d[0] and self.is_between_values(node_b[0], node_c[0], node_d[0])) or \
-                    (node_a[0] == node_d[0] and self.is_between_values(node_c[0], node_a[0], node_b[0])) or \
-                    (node_b[0] == node_c[0] and self.is_between_values(node_a[0], node_c[0], node_d[0])) or \
-                    (node_b[0] == node_c[0] and self.is_between_values(node_d[0], node_a[0], node_b[0])) or \
-                    (node_b[0] == node_d[0] and self.is_between_values(node_a[0], node_c[0], node_d[0])) or \
-                    (node_b[0] == node_d[0] and self.is_between_values(node_c[0], node_a[0], node_b[0])):
-                    do_intersect = True
-        else:
-            line_1 = self.line_creation(node_a, node_b)
-            line_2 = self.line_creation(node_c, node_d)
-            intersect = self.intersection(line_1, line_2)
-            rounding_error = 0.000005
-            if intersect is not False:
-                if (self.is_between_values(intersect[0], node_a[0], node_b[0]) or intersect[0] == node_a[0])\
-                        and (self.is_between_values(intersect[1], node_a[1], node_b[1]) or intersect[1] == node_a[1])\
-                        and (self.is_between_values(intersect[0], node_c[0], node_d[0]) or intersect[0] == node_c[0])\
-                        and (self.is_between_values(intersect[1], node_c[1], node_d[1]) or intersect[1] == node_c[1]):
-                    if not ((self.is_between_values(intersect[0], node_a[0] - rounding_error, node_a[0] + rounding_error) and
-                             self.is_between_values(intersect[1], node_a[1] - rounding_error, node_a[1] + rounding_error)) or
-                            (self.is_between_values(intersect[0], node_b[0] - rounding_error, node_b[0] + rounding_error) and
-                             self.is_between_values(intersect[1], node_b[1] - rounding_error, node_b[1] + rounding_error)) or
-                            (self.is_between_values(intersect[0], node_c[0] - rounding_error, node_c[0] + rounding_error) and
-                             self.is_between_values(intersect[1], node_c[1] - rounding_error, node_c[1] + rounding_error)) or
-                            (self.is_between_values(intersect[0], node_d[0] - rounding_error, node_d[0] + rounding_error) and
-                             self.is_between_values(intersect[1], node_d[1] - rounding_error, node_d[1] + rounding_error))):
-                        do_intersect = True
-        return do_intersect
-
-    # Create imaginary lines to test for intersection
-    def line_creation(self, a, b):
-        A = (a[1] - b[1])
-        B = (b[0] - a[0])
-        C = (a[0]*b[1] - b[0]*a[1])
-        return A, B, -C
-
-    # Test line segments for intersection point
-    def intersection(self, a, b):
-        D = a[0]*b[1] - a[1]*b[0]
-        Dx = a[2]*b[1] - a[1]*b[2]
-        Dy = a[0]*b[2] - a[2]*b[0]
-
-        if D != 0:
-            x = Dx/D
-            y = Dy/D
-            return x, y
-        else:
-            return False
+    # Key for a shared evaluation store, with the members in their own order so stored results line up with them
+    def fingerprint(self):
+        return self.evaluation_cache.key(self, np.arange(self.m))
 
-    # See if value is between two other values
-    def is_between_values(self, num, a, b):
-        minimum = min(a, b)
-        maximum = max(a, b)
-        if minimum < num < maximum:
-            is_between = True
-        else:
-            is_between = False
-        return is_between
+    # Results of evaluate() that a shared evaluation store restores along with those it returns
+    def evaluation_state(self):
+        return {'stable_system': self.stable_system, 'mass': self.mass, 'fos': self.fos, 'case_fos': self.case_fos,
+                'force': self.force, 'stable': self.stable}
 
     # Function needed to make copy of Truss object by agent
     def __deepcopy__(self, memo):
-        deepcopy_method = self.__deepcopy__
-        self.__deepcopy__ = None
-        cp = copy.deepcopy(self, memo)
-        self.__deepcopy__ = deepcopy_method
+        cp = self.__class__.__new__(self.__class__)
+        memo[id(self)] = cp
+
+        # Core storage is shared copy-on-write, so a copy that is only evaluated never copies it
+        cp.n = self.n
+        cp.m = self.m
+        cp._coord = self._coord
+        cp._con = self._con
+        cp._sizes = self._sizes
+        cp._neighbors = self._neighbors
+        cp._member_index = self._member_index
+        cp._grid = self._grid
+        cp._rule_sets = self._rule_sets
+        cp._rule_lists = {}
+        cp._topology = self._topology
+        cp._dirty = None if self._dirty is None else set(self._dirty)
+        self._shared = True
+        cp._shared = True
+
+        # Constant arrays and the caches are shared outright
+        cp.em = self.em
+        cp.ej = self.ej
+        cp.dof = self.dof
+        cp.reanalysis = self.reanalysis
+        cp.evaluation_cache = self.evaluation_cache
+
+        cp.fixed_joints = list(self.fixed_joints)
+        cp.force_joints = list(self.force_joints)
+        cp.load_cases = [dict(load_case) for load_case in self.load_cases]
+        cp.undeletable_joints = list(self.undeletable_joints)
+        cp.applied_rules = list(self.applied_rules)
+        cp.target_fos = self.target_fos
+        cp.force = np.copy(self.force)
+        cp.fos = np.copy(self.fos)
+        cp.case_fos = np.copy(self.case_fos)
+        cp.mass = self.mass
+        cp.stable_system = self.stable_system
+        if hasattr(self, 'stable'):
+            cp.stable = self.stable
+
+        # Results of rule_check are not copied, they are rebuilt before the next rule is applied. Anything else
+        # set on the instance (options, solution ids) is copied as usual.
+        for key, value in self.__dict__.items():
+            if key not in cp.__dict__:
+                setattr(cp, key, copy.deepcopy(value, memo))
         return cp
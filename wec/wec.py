@@ -9,12 +9,15 @@ import pkg_resources
 import random
 
 import copy
+import hashlib
 
 import wec.wec_visual
 import time
 
 
 class WEC(AbstractBaseSolution):
+    num_lowtier_rules = 8
+    num_hightier_rules = 6
     simulation_dt = 0.005
     simulation_steps = 4000
     initial_steps = 2000
@@ -1605,8 +1608,7 @@ class WEC(AbstractBaseSolution):
 
     # Low-tier random rule selection
     def lowtier_rule_select(self):
-        num_rules = 8
-        rule = random.randint(1, num_rules)
+        rule = random.randint(1, self.num_lowtier_rules)
 
         # TODO: THIS IS ONLY FOR THE TESTS WHICH OPTIMIZE PRE-DETERMINED TOPOLOGIES
         # num_rules = 2
@@ -1622,8 +1624,7 @@ class WEC(AbstractBaseSolution):
     # High-tier random rule selection
     def hightier_rule_select(self):
         # Not counting H1 (Generate initial design) as option for rule application
-        num_rules = 6
-        rule = random.randint(2, num_rules)
+        rule = random.randint(2, self.num_hightier_rules)
         print("HT Rule:", rule)
         return rule
 
@@ -2075,6 +2076,20 @@ class WEC(AbstractBaseSolution):
             if connections == 1:
                 self.deletable_bodies.append((n, pto_index, type))
 
+    # Design data the simulation starts from, used to share evaluations between agents. It has to be read before
+    # the simulation moves the bodies.
+    def fingerprint(self):
+        bodies = [(body['body_shape'], body['density'], body['radius'], body['length'], body['angle_offset'],
+                   tuple(body['body'].position), body['body'].angle) for body in self.bodies]
+        linear_ptos = [(pto['idxa'], pto['idxb'], pto['resting_length'], pto['stiffness'], pto['damping'])
+                       for pto in self.linear_ptos_data]
+        rotary_ptos = [(pto['idxa'], pto['idxb'], pto['rest_angle'], pto['stiffness'], pto['damping'])
+                       for pto in self.rotary_ptos_data]
+        moorings = [(tuple(fixed['position']), body_index, cable.stiffness, cable.damping)
+                    for fixed, body_index, cable in zip(self.fixed_bodies, self.mooring_attachment_points,
+                                                        self.cable_bodies)]
+        return hashlib.sha1(repr((bodies, linear_ptos, rotary_ptos, moorings)).encode()).digest()
+
     # Function needed to make copy of WEC object by agent
     def __deepcopy__(self, memo):
         deepcopy_method = self.__deepcopy__